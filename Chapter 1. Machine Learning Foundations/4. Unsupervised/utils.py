@@ -49,15 +49,19 @@ def visualise_regression_data(X, Y, y_hat=None):
 def calc_accuracy(predictions, labels):
     return np.mean((predictions == labels).astype(int)) * 100
 
-def visualise_predictions(H, X, Y=None, n=50):
-    xmin, xmax, ymin, ymax = min(X[:, 0]), max(X[:, 0]), min(X[:, 1]), max(X[:, 1])
-    meshgrid = np.zeros((n, n))
-    for x1_idx, x1 in enumerate(np.linspace(xmin, xmax, n)): # for each column
-        for x2_idx, x2 in enumerate(np.linspace(ymin, ymax, n)): # for each row
-            h = H(np.array([[x1, x2]])).astype(int)[0]
-            meshgrid[n-1-x2_idx, x1_idx] = h # axis 0 is the vertical direction starting from the top and increasing downward
+def visualise_predictions(H, X, Y=None, n=50, batch_size=65536, max_points=None):
+    xmin, xmax, ymin, ymax = np.min(X[:, 0]), np.max(X[:, 0]), np.min(X[:, 1]), np.max(X[:, 1])
+    # axis 0 is the vertical direction starting from the top and increasing downward
+    x1, x2 = np.meshgrid(np.linspace(xmin, xmax, n), np.linspace(ymin, ymax, n)[::-1])
+    grid = np.column_stack((x1.ravel(), x2.ravel()))
+    h = [np.asarray(H(batch)).astype(int).reshape(len(batch), -1)[:, 0] # H is called once per batch of grid points
+         for batch in np.array_split(grid, max(1, -(-len(grid) // batch_size)))]
+    meshgrid = np.concatenate(h).reshape(n, n)
+    if max_points is not None and len(X) > max_points: # scatter only random subset of large datasets
+        shown = np.random.choice(len(X), max_points, replace=False)
+        X, Y = X[shown], (None if Y is None else np.asarray(Y)[shown])
     if Y is not None:
-        for idx in list(set(Y)):
+        for idx in np.unique(Y):
             plt.scatter(X[Y == idx][:, 0], X[Y== idx][:, 1], c=colors[idx])
     else:
         plt.scatter(X[:,0], X[:, 1])
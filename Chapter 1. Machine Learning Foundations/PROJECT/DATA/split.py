@@ -1,18 +1,21 @@
 import numpy as np
-dont run this file
 import pandas as pd
 
+raise SystemExit("dont run this file, it overwrites train/test split of the project")
+
 d = pd.read_csv('winequality-red.csv', delimiter=';')
 print(len(d))
 
-train_idxs = np.random.choice(range(len(d)), size=int(0.8*len(d)))
+# Permutation samples without replacement, every row ends in exactly one split
+random = np.random.default_rng(0)
+permutation = random.permutation(len(d))
+train_idxs = np.sort(permutation[: int(0.8 * len(d))])
 train = d.iloc[train_idxs]
 print(len(train))
 
-test_idxs = np.full(len(d), True)
-test_idxs[train_idxs] = False
+test_idxs = np.sort(permutation[int(0.8 * len(d)) :])
 test = d.iloc[test_idxs]
 print(len(test))
 
 train.to_csv('winequality-red-train.csv')
-test.to_csv('winequality-red-test.csv')
\ No newline at end of file
+test.to_csv('winequality-red-test.csv')
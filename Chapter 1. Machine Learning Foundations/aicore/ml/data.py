@@ -1,6 +1,11 @@
+import functools
+import itertools
+import queue
+import threading
+
 import matplotlib.pyplot as plt
 import numpy as np
-from sklearn import datasets, model_selection, preprocessing
+from sklearn import datasets, preprocessing
 
 ###############################################################################
 #
@@ -26,20 +31,121 @@ def polynomial_datasets(degree: int, *datasets):
 ###############################################################################
 
 
+def _standardize(batch, mean, std):
+    return (batch - mean) / std
+
+
 def standardize(dataset, mean=None, std=None):
     if mean is None and std is None:
-        mean, std = np.mean(dataset, axis=0), np.std(
-            dataset, axis=0
-        )  # get mean and standard deviation of dataset
-    standardized_dataset = (dataset - mean) / std
+        if isinstance(dataset, NpyDataset):
+            standardizer = RunningStandardizer().fit(dataset)
+            mean, std = standardizer.mean, standardizer.std
+        else:
+            mean, std = np.mean(dataset, axis=0), np.std(
+                dataset, axis=0
+            )  # get mean and standard deviation of dataset
+    if isinstance(dataset, NpyDataset):
+        # Data on disk is standardized lazily, batch by batch
+        standardized_dataset = dataset.map(
+            functools.partial(_standardize, mean=mean, std=std)
+        )
+    else:
+        standardized_dataset = _standardize(dataset, mean, std)
     return standardized_dataset, (mean, std)
 
 
 def standardize_multiple(*datasets):
+    """Standardize all datasets with statistics of the first one.
+
+    Returns list, so every dataset is standardized even if result is
+    not fully iterated.
+
+    """
     mean, std = None, None
+    standardized = []
     for dataset in datasets:
         dataset, (mean, std) = standardize(dataset, mean, std)
-        yield dataset
+        standardized.append(dataset)
+    return standardized
+
+
+class RunningStandardizer:
+    """Standardization statistics computed in a single pass over chunks.
+
+    Each chunk's mean and sum of squared deviations are merged into
+    running statistics with Chan's parallel formula (Welford's algorithm
+    generalized to chunks), which is numerically stable and never needs
+    the whole dataset in memory. Statistics of standardizers fitted on
+    different shards (e.g. by worker processes) can be combined with
+    `merge`.
+
+    Example:
+
+        standardizer = RunningStandardizer()
+        for chunk in stream:
+            standardizer.partial_fit(chunk)
+        for chunk in dataset.chunks():
+            standardizer.transform(chunk, out=chunk)
+
+    Attributes:
+        count (int):
+            Number of samples seen so far.
+        mean (Optional[np.array]):
+            Mean of every feature (float64).
+        m2 (Optional[np.array]):
+            Sum of squared deviations from mean of every feature.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    @property
+    def var(self):
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def _update(self, count: int, mean, m2) -> None:
+        if count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = count, mean, m2
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + np.square(delta) * (self.count * count / total)
+        self.count = total
+
+    def partial_fit(self, batch) -> "RunningStandardizer":
+        """Update statistics with batch of samples (rows)."""
+        batch = np.asarray(batch)
+        if batch.shape[0] == 0:
+            return self
+        mean = np.mean(batch, axis=0, dtype=np.float64)
+        m2 = np.sum(np.square(batch - mean), axis=0)
+        self._update(batch.shape[0], mean, m2)
+        return self
+
+    def fit(self, dataset, chunk_size: int = 65536) -> "RunningStandardizer":
+        """Update statistics with array (or `NpyDataset`) chunk by chunk."""
+        for start in range(0, dataset.shape[0], chunk_size):
+            self.partial_fit(dataset[start : start + chunk_size])
+        return self
+
+    def merge(self, other: "RunningStandardizer") -> "RunningStandardizer":
+        """Add statistics of other standardizer (fitted on other samples)."""
+        self._update(other.count, other.mean, other.m2)
+        return self
+
+    def transform(self, batch, out=None):
+        """Standardize batch, in place if `out` is provided (e.g. `batch`)."""
+        out = np.subtract(batch, self.mean, out=out, casting="same_kind")
+        return np.divide(out, self.std, out=out, casting="same_kind")
 
 
 ###############################################################################
@@ -50,20 +156,230 @@ def standardize_multiple(*datasets):
 
 
 class DataLoader:
-    def __init__(self, *datasets, batch_size: int):
+    """Iterate over batches of datasets sharing first (samples) dimension.
+
+    Datasets are never modified nor copied as a whole. Every epoch only
+    indices are shuffled and each batch gathers it's rows (in storage order,
+    which is faster for memory mapped data), without shuffling batches are
+    contiguous views.
+
+    Attributes:
+        datasets (Tuple):
+            Arrays (or `scipy.sparse` matrices) with the same number of rows.
+        batch_size (int):
+            Number of samples in each batch.
+        shuffle (bool):
+            Whether samples are drawn in random order every epoch.
+        drop_last (bool):
+            Whether last batch smaller than `batch_size` is skipped.
+        prefetch (int):
+            Number of batches prepared ahead by background thread, `0`
+            prepares batches when requested.
+    """
+
+    def __init__(
+        self,
+        *datasets,
+        batch_size: int,
+        shuffle: bool = True,
+        drop_last: bool = True,
+        prefetch: int = 0,
+    ):
         self.datasets = datasets
         self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+
+    def __len__(self):
+        # Shape instead of len as it works for sparse matrices
+        samples = self.datasets[0].shape[0]
+        if self.drop_last:
+            return samples // self.batch_size
+        return -(-samples // self.batch_size)
+
+    def _batches(self):
+        samples = self.datasets[0].shape[0]
+        permutation = np.random.permutation(samples) if self.shuffle else None
+        for i in range(len(self)):
+            start, stop = i * self.batch_size, min((i + 1) * self.batch_size, samples)
+            if permutation is None:
+                yield [dataset[start:stop] for dataset in self.datasets]
+            else:
+                indices = np.sort(permutation[start:stop])
+                yield [dataset[indices] for dataset in self.datasets]
 
     def __iter__(self):
-        permutation = np.random.permutation(self.datasets[0].shape[0])
-        # Use permutation to shuffle every dataset
-        self.datasets = [dataset[permutation] for dataset in self.datasets]
-        # Yield batches
-        for i in range(len(self.datasets[0]) // self.batch_size):
-            yield [
-                dataset[i * self.batch_size : (i + 1) * self.batch_size]
-                for dataset in self.datasets
-            ]
+        if self.prefetch:
+            return _prefetch(self._batches(), self.prefetch)
+        return self._batches()
+
+
+def _prefetch(iterable, size: int):
+    """Yield items of iterable produced ahead by background thread."""
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Consumer may stop early (e.g. early stopping), producer must not hang
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as error:
+            put((None, error))
+            return
+        put((_END, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+# Marks end of prefetched iterable
+_END = object()
+
+
+###############################################################################
+#
+#                           OUT-OF-CORE DATA
+#
+###############################################################################
+
+
+class NpyDataset:
+    """Array stored in `.npy` file, memory mapped instead of loaded.
+
+    Rows are read from disk (and cached by operating system) only when
+    indexed, so data larger than RAM can be used with `DataLoader`,
+    `standardize_multiple` or passed directly to `fit` of graph models.
+
+    Example:
+
+        X = NpyDataset("features.npy")
+        y = NpyDataset("targets.npy")
+        X_train, = standardize_multiple(X)
+        model.fit(DataLoader(X_train, y, batch_size=1024))
+
+    Attributes:
+        data (np.memmap):
+            Memory mapped array with the data.
+        transform (Optional[Callable[[np.array], np.array]]):
+            Function applied to every batch read from `data`, e.g.
+            standardization.
+    """
+
+    def __init__(self, path, transform=None, mmap_mode: str = "r"):
+        self.data = np.load(path, mmap_mode=mmap_mode)
+        self.transform = transform
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        batch = np.asarray(self.data[index])
+        if self.transform is None:
+            return batch
+        return self.transform(batch)
+
+    def __array__(self, dtype=None):
+        # Loads (and transforms) whole data, prefer batches or `chunks`
+        return np.asarray(self[:], dtype=dtype)
+
+    def chunks(self, chunk_size: int = 65536):
+        """Yield consecutive blocks of at most `chunk_size` rows."""
+        for start in range(0, len(self), chunk_size):
+            yield self[start : start + chunk_size]
+
+    def map(self, transform) -> "NpyDataset":
+        """Return dataset sharing the same file with `transform` applied."""
+        dataset = object.__new__(NpyDataset)
+        dataset.data = self.data
+        if self.transform is None:
+            dataset.transform = transform
+        else:
+            dataset.transform = lambda batch: transform(self.transform(batch))
+        return dataset
+
+
+def _data_lines(file, skiprows: int):
+    """Yield non-empty lines of file after skipping header rows."""
+    return (line for line in itertools.islice(file, skiprows, None) if line.strip())
+
+
+def csv_to_npy(
+    csv_path,
+    npy_path,
+    delimiter: str = ",",
+    skiprows: int = 0,
+    usecols=None,
+    dtype=np.float64,
+    chunk_size: int = 65536,
+) -> NpyDataset:
+    """Convert numeric CSV to `.npy` file without loading it into memory.
+
+    File is read twice: to count rows, so `.npy` can be preallocated on
+    disk, and to parse it `chunk_size` rows at a time.
+
+    Arguments:
+        usecols:
+            Columns to convert (see `np.loadtxt`), single integer creates
+            1D array (e.g. targets).
+
+    Returns:
+        `NpyDataset` backed by newly created file.
+
+    """
+    ndmin = 1 if isinstance(usecols, int) else 2
+    with open(csv_path) as file:
+        lines = _data_lines(file, skiprows)
+        first = np.loadtxt(
+            [next(lines)], delimiter=delimiter, usecols=usecols, ndmin=ndmin
+        )
+        rows = 1 + sum(1 for _ in lines)
+
+    output = np.lib.format.open_memmap(
+        npy_path, mode="w+", dtype=dtype, shape=(rows,) + first.shape[1:]
+    )
+    with open(csv_path) as file:
+        lines = _data_lines(file, skiprows)
+        offset = 0
+        for chunk in iter(lambda: list(itertools.islice(lines, chunk_size)), []):
+            values = np.loadtxt(
+                chunk, delimiter=delimiter, usecols=usecols, dtype=dtype, ndmin=ndmin
+            )
+            output[offset : offset + len(values)] = values
+            offset += len(values)
+    output.flush()
+    del output
+    return NpyDataset(npy_path)
 
 
 ###############################################################################
@@ -73,16 +389,156 @@ class DataLoader:
 ###############################################################################
 
 
-def split(dataset, non_train: float = 0.4):
+def _cut(indices, fractions):
+    """Cut indices into consecutive parts of sizes given by fractions."""
+    bounds = np.round(np.cumsum(fractions)[:-1] * len(indices)).astype(int)
+    return np.split(indices, bounds)
+
+
+def split_indices(
+    n_samples: int,
+    fractions=(0.6, 0.2, 0.2),
+    stratify=None,
+    groups=None,
+    seed=None,
+):
+    """Return sorted indices of samples in each partition.
+
+    Only indices are created, data itself is never copied, hence any
+    partition can be gathered (or written to disk, see `save_partitions`)
+    when needed. Sorted indices read rows in storage order, which is
+    much faster for memory mapped data.
+
+    Arguments:
+        n_samples:
+            Number of samples to split.
+        fractions:
+            Fraction of samples in each partition, have to sum to `1`.
+        stratify:
+            Labels of samples, every partition will contain the same
+            fraction of every label.
+        groups:
+            Group of every sample (e.g. patient), all samples of a group
+            are placed in the same partition. Partition sizes are then
+            only approximately equal to `fractions`.
+        seed:
+            Seed (or `np.random.Generator`) making split deterministic.
+
+    Returns:
+        List[np.array]: Indices of every partition.
+
+    """
+    if not np.isclose(np.sum(fractions), 1):
+        raise ValueError("Fractions of partitions have to sum to 1.")
+    if stratify is not None and groups is not None:
+        raise ValueError("Split can be either stratified or group-aware, not both.")
+    random = np.random.default_rng(seed)
+
+    if groups is not None:
+        unique, inverse, counts = np.unique(
+            groups, return_inverse=True, return_counts=True
+        )
+        order = random.permutation(len(unique))
+        # Group goes to partition in which it's first sample would fall
+        starts = np.cumsum(counts[order]) - counts[order]
+        bounds = np.cumsum(fractions)[:-1] * n_samples
+        group_partition = np.empty(len(unique), dtype=int)
+        group_partition[order] = np.searchsorted(bounds, starts, side="right")
+        sample_partition = group_partition[np.ravel(inverse)]
+        return [np.flatnonzero(sample_partition == i) for i in range(len(fractions))]
+
+    if stratify is None:
+        permutation = random.permutation(n_samples)
+        return [np.sort(part) for part in _cut(permutation, fractions)]
+
+    partitions = [[] for _ in fractions]
+    labels = np.asarray(stratify)
+    for label in np.unique(labels):
+        members = random.permutation(np.flatnonzero(labels == label))
+        for partition, part in zip(partitions, _cut(members, fractions)):
+            partition.append(part)
+    return [np.sort(np.concatenate(partition)) for partition in partitions]
+
+
+def split(
+    dataset,
+    non_train: float = 0.4,
+    stratify: bool = False,
+    groups=None,
+    seed=None,
+):
+    """Split `(X, y)` into train, validation and test (halves of `non_train`).
+
+    Every partition is gathered once from `X` and `y`, see `split_indices`
+    for remaining arguments (`stratify=True` stratifies by `y`).
+
+    """
     X, y = dataset
-    X_train, X_test, y_train, y_test = model_selection.train_test_split(
-        X, y, test_size=non_train
+    indices = split_indices(
+        X.shape[0],
+        fractions=(1 - non_train, non_train / 2, non_train / 2),
+        stratify=y if stratify else None,
+        groups=groups,
+        seed=seed,
     )
+    return tuple((X[partition], y[partition]) for partition in indices)
 
-    X_validation, X_test, y_validation, y_test = model_selection.train_test_split(
-        X_test, y_test, test_size=0.5
-    )
-    return (X_train, y_train), (X_validation, y_validation), (X_test, y_test)
+
+def save_partitions(dataset, partitions, paths, chunk_size: int = 65536) -> None:
+    """Write rows of dataset selected by each partition to it's own file.
+
+    Rows are gathered `chunk_size` at a time, so dataset (e.g.
+    `NpyDataset`) never has to fit into memory. Files ending with
+    `.parquet` are written with `pyarrow` (has to be installed, columns
+    are named by their index), any other path is written as memory
+    mappable `.npy` file (see `NpyDataset`).
+
+    Arguments:
+        dataset:
+            Array or `NpyDataset` to take rows from.
+        partitions:
+            Indices of rows, e.g. returned by `split_indices`.
+        paths:
+            Output file of every partition.
+
+    """
+    for indices, path in zip(partitions, paths):
+        chunks = (
+            np.asarray(dataset[indices[start : start + chunk_size]])
+            for start in range(0, len(indices), chunk_size)
+        )
+        if str(path).endswith(".parquet"):
+            _write_parquet(chunks, path)
+            continue
+        output = np.lib.format.open_memmap(
+            path,
+            mode="w+",
+            dtype=dataset.dtype,
+            shape=(len(indices),) + tuple(dataset.shape[1:]),
+        )
+        offset = 0
+        for chunk in chunks:
+            output[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+        output.flush()
+        del output
+
+
+def _write_parquet(chunks, path) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            columns = chunk.reshape(len(chunk), -1).T
+            table = pa.table({str(i): column for i, column in enumerate(columns)})
+            if writer is None:
+                writer = pq.ParquetWriter(str(path), table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
 
 
 ###############################################################################
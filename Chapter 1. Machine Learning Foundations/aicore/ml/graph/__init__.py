@@ -1,4 +1,7 @@
-from . import models, optimizers
-from ._graph import get, no_grad
+from . import models, optimizers, testing
+from ._arena import ParameterArena
+from ._graph import (checkpoint, get, get_default_dtype, no_grad, scope,
+                     set_default_dtype)
 from ._operations import *
 from ._parameter import Parameter
+from ._profiler import Profiler, profile
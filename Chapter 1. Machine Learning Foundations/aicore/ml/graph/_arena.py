@@ -0,0 +1,57 @@
+import numpy as np
+
+from ._parameter import Parameter
+
+
+class ParameterArena:
+    """Contiguous storage for multiple parameters and their gradients.
+
+    All parameters (and their gradients) are laid out in one flat buffer,
+    each parameter being a view of it. Optimizer can then update the whole
+    model in a single vectorized step via `arena.data` and the model can be
+    checkpointed with single `save`.
+
+    Example:
+
+        arena = ParameterArena([W, b])
+        W, b = arena.parameters
+        ...
+        get().backward()
+        optimizer(arena.data)
+
+    Attributes:
+        data (Parameter):
+            Flat parameter containing values of all parameters. It's
+            `gradient` is the flat buffer with all gradients.
+        parameters (List[Parameter]):
+            Views of `data` with shapes of parameters used to create arena.
+            These should be used in place of the original parameters.
+    """
+
+    def __init__(self, parameters, dtype=None):
+        parameters = list(parameters)
+        if dtype is None:
+            dtype = np.result_type(*(parameter.dtype for parameter in parameters))
+        size = sum(parameter.size for parameter in parameters)
+        self.data = Parameter(np.empty(size, dtype=dtype), dtype=dtype)
+        self.data.gradient = np.zeros(size, dtype=dtype)
+        self.data.shares_gradient = True
+
+        self.parameters = []
+        offset = 0
+        for parameter in parameters:
+            chunk = slice(offset, offset + parameter.size)
+            view = Parameter(self.data[chunk].reshape(parameter.shape), dtype=dtype)
+            view[...] = parameter
+            view.gradient = self.data.gradient[chunk].reshape(parameter.shape)
+            view.shares_gradient = True
+            self.parameters.append(view)
+            offset += parameter.size
+
+    def save(self, file) -> None:
+        """Save all parameters as single `.npy` array."""
+        np.save(file, np.asarray(self.data))
+
+    def load(self, file) -> None:
+        """Load parameters saved by `save` in place."""
+        np.copyto(self.data, np.load(file))
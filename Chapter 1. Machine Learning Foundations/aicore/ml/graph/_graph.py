@@ -1,5 +1,13 @@
 import contextlib
+import functools
+import itertools
 import json
+import threading
+import time
+import warnings
+import weakref
+
+import numpy as np
 
 
 class Graph:
@@ -10,27 +18,56 @@ class Graph:
     should be called on final parameter (after all operations
     were performed).
 
+    Operations are recorded on a flat tape in the order they were run,
+    which is always a valid topological order (an operation can only consume
+    outputs of operations recorded before it). `backward` walks the tape
+    once in reverse, so it is linear in the number of recorded operations
+    and does not recurse.
+
+    Operations whose output was garbage collected and which are not
+    consumed by any other recorded operation can never reach the loss,
+    those are dropped from the tape right away (except for the last one,
+    which `backward` seeds). Hence code which records operations without
+    ever calling `backward` (e.g. `X @ model.W` on a serving thread) does
+    not grow the tape.
+
     Attributes:
-        operations (Dict[int, (Operation, Dict[int, (int, bool)])]):
-            List of operations which, when backpropagated produce gradients
-            for Parameters. Each item is a Tuple containing:
+        operations (Dict[int, (Operation, Dict[int, (Union[int, Parameter], bool)])]):
+            Tape of operations which, when backpropagated produce gradients
+            for Parameters, by their (increasing) index. Each item is a Tuple
+            containing:
             - Instance of operation
             - Dictionary containing:
                 - index of input parameter (so usually it is [0, 1, 2, 3...])
                 - Tuple containing:
-                    - index of operation which created this input parameter
+                    - index of operation which created this input or
+                      the Parameter itself if it is a leaf
                     - True/False value whether this node is a leaf
 
             If node is a leaf it has to be parameter and backpropagation stops
             at this call to `backward` (see `Parameter` class)
 
-        parameters (List[Parameter])
-            List of parameters added to this graph.
+        parameters (weakref.WeakValueDictionary[int, Parameter])
+            Parameters added to this graph by their index. Only weak
+            references are kept, so parameters which are not used anymore
+            are freed and removed from graph automatically.
     """
 
     def __init__(self):
         self.operations = {}
-        self.parameters = []
+        self.parameters = weakref.WeakValueDictionary()
+        self._parameter_indices = itertools.count()
+        self._operation_indices = itertools.count()
+        self._reset_tape()
+
+    def _reset_tape(self) -> None:
+        # Weak references to outputs of operations which are still alive
+        self._outputs = {}
+        # Number of recorded operations consuming output of each operation
+        self._consumers = {}
+        # Last operation (and it's output shape), which `backward` seeds
+        self._last = None
+        self._output_shape = None
 
     def _register_parameter(self, parameter: "Parameter"):
         """Registers parameter inside the graph
@@ -42,20 +79,78 @@ class Graph:
             Index of parameter inside the graph which is saved in parameter's instance.
 
         """
-        self.parameters.append(parameter)
-        return len(self.parameters) - 1
+        index = next(self._parameter_indices)
+        self.parameters[index] = parameter
+        return index
+
+    def release(self, *parameters) -> None:
+        """Remove parameters from the graph explicitly."""
+        for parameter in parameters:
+            if self.parameters.get(parameter.index_in_graph) is parameter:
+                del self.parameters[parameter.index_in_graph]
+
+    def clear(self) -> None:
+        """Drop all recorded operations (and their caches) without backward.
+
+        Useful if operations were recorded but gradient is not needed,
+        otherwise those would stay in memory until next `backward`.
+
+        """
+        for operation, _ in self.operations.values():
+            operation.cache = None
+            operation.index_in_graph = None
+            operation.segment = None
+        self.operations = {}
+        self._reset_tape()
 
-    def _register_operation(self, operation: "Operation", inputs):
+    def _register_operation(self, operation: "Operation", inputs, output):
         """Registers operation inside the graph
 
         Returns:
-            Index of operation inside the graph which is saved in parameter's instance.
+            Index of operation inside the graph which is saved in operation's output.
 
         """
         if has_grad():
-            last_index = len(list(self.operations.keys()))
-            self.operations[last_index] = (operation, inputs)
-            return last_index
+            index = next(self._operation_indices)
+            self.operations[index] = (operation, inputs)
+            for node, is_leaf in inputs.values():
+                if not is_leaf:
+                    self._consumers[node] = self._consumers.get(node, 0) + 1
+            self._outputs[index] = weakref.ref(
+                output, functools.partial(_output_collected, weakref.ref(self), index)
+            )
+            previous, self._last = self._last, index
+            self._output_shape = np.shape(output)
+            if previous is not None:
+                self._drop(previous)
+            return index
+
+    def _drop(self, index: int) -> None:
+        """Drop operation (and it's inputs) if it cannot reach the loss anymore."""
+        pending = [index]
+        while pending:
+            index = pending.pop()
+            if (
+                index not in self.operations
+                or index == self._last
+                or index in self._outputs
+                or self._consumers.get(index)
+            ):
+                continue
+            operation, inputs = self.operations.pop(index)
+            self._consumers.pop(index, None)
+            operation.cache = None
+            operation.index_in_graph = None
+            operation.segment = None
+            for node, is_leaf in inputs.values():
+                if not is_leaf:
+                    self._consumers[node] -= 1
+                    pending.append(node)
+
+    def _is_recorded(self, operation: "Operation") -> bool:
+        """Whether operation is on this graph's tape (not backpropagated yet)."""
+        entry = self.operations.get(operation.index_in_graph)
+        return entry is not None and entry[0] is operation
 
     @staticmethod
     def _get_gradient(upstream_gradient, output_index):
@@ -67,58 +162,35 @@ class Graph:
             return upstream_gradient[output_index]
         return upstream_gradient
 
-    def _backpropagate_node(
-        self, upstream_gradient, output_index, operation_index, is_leaf
-    ) -> None:
-        """Backpropagate through single node (Operation or Parameter).
-
-        If Parameter (is_leaf=True) is reached backpropagation will end with
-        populating it's gradient.
-
-        If Operation (is_leaf=False) is reached the node will be run through
-        graph backpropagation again.
+    @staticmethod
+    def _accumulate(gradients, index, gradient) -> None:
+        """Add gradient to the one already flowing into node at `index`.
 
-        """
-        gradient = Graph._get_gradient(upstream_gradient, output_index)
-        if is_leaf:
-            self.parameters[operation_index].backward(gradient)
-        else:
-            # If we went through this operation we should raise an error
-            new_operation = self.operations.pop(operation_index, None)
-            if new_operation is None:
-                raise ValueError(
-                    "Trying to backpropagate through non-existent node. Are your paths disjoint?"
-                )
-            self._backpropagate_graph(new_operation, gradient)
-
-    def _backpropagate_graph(self, operation_and_mapping, upstream_gradient):
-        """Backpropagate through graph of operations.
-
-        For any incoming operation it will go over their inputs
-        (defined by mapping which points to input nodes) and propagate
-        current upstream gradient to them.
-
-        After calculation of gradient it's internal cached is clear by the graph
+        Nodes with fan-out (used as an input of many operations) receive one
+        gradient per consumer which have to be summed. Gradients are never
+        modified in place as operations are free to return the same array
+        for multiple inputs (see `_Add`).
 
         """
-        operation, mapping = operation_and_mapping
-        upstream_gradient = operation.backward(upstream_gradient)
-        # Clean cache
-        operation.cache = None
-        # Multiple outputs
-        for output_index, (operation_index, is_leaf) in mapping.items():
-            self._backpropagate_node(
-                upstream_gradient, output_index, operation_index, is_leaf
-            )
+        current = gradients.get(index)
+        gradients[index] = gradient if current is None else current + gradient
 
     def backward(self, upstream_gradient=1) -> None:
         """Entrypoint for backpropagation through registered nodes.
 
-        `backward` will run through all the nodes contained inside graph in succession,
-        starting with the one added as the last one.
+        `backward` runs through the tape once, starting with the operation
+        added as the last one. Gradient flowing into each operation is the
+        sum of gradients from all operations consuming its output, hence
+        paths do not have to be disjoint and a Parameter may be used by
+        multiple operations.
 
-        If there are multiple __separable__ paths those will be backpropagated
-        as well. If they aren't separable an error will be raised.
+        Only the last recorded operation (the loss) is seeded with
+        `upstream_gradient`. It's output has to be a scalar or have the same
+        shape as `upstream_gradient`, otherwise `ValueError` is raised.
+        Operations the loss does not depend on (e.g. `W - 1` printed
+        while recording) are dropped with a warning, as they would otherwise
+        leak gradient into parameters. Use `no_grad` for computations which
+        do not need gradient.
 
         When graph's `backward` is called it will be cleaned from
         all operations (parameters stay inside graph until the graph instance
@@ -128,32 +200,243 @@ class Graph:
         if not has_grad():
             raise ValueError("Cannot perform backward as tape recording is off.")
 
-        while self.operations:
-            last_index = list(self.operations.keys())[-1]
-            self._backpropagate_graph(
-                self.operations.pop(last_index), upstream_gradient
+        shape = self._output_shape
+        if self.operations and shape != () and shape != np.shape(upstream_gradient):
+            raise ValueError(
+                f"Last recorded operation has output of shape {shape}, loss has "
+                "to be a scalar (or `upstream_gradient` of the same shape)."
             )
-        for parameter in self.parameters:
-            parameter.last_operation_index = None
 
+        operations, self.operations = self.operations, {}
+        gradients = {self._last: upstream_gradient}
+        self._reset_tape()
+        profiler = _state.profiler
+        unreached = 0
+        for index in reversed(list(operations)):
+            # Free tape entry as soon as possible
+            operation, mapping = operations.pop(index)
+            gradient = gradients.pop(index, None)
+            if gradient is None:
+                # Loss does not depend on this operation
+                unreached += 1
+                operation.cache = None
+                operation.index_in_graph = None
+                operation.segment = None
+                continue
+            if operation.segment is not None:
+                # Caches of checkpointed operations were dropped, recreate them
+                operation.segment.recompute()
+                operation.segment = None
+            if profiler is None:
+                gradient = operation.backward(gradient)
+            else:
+                start = time.perf_counter()
+                gradient = operation.backward(gradient)
+                profiler.record(operation, "backward", start, time.perf_counter())
+            # Clean cache
+            operation.cache = None
+            operation.index_in_graph = None
+            # Multiple inputs
+            for input_index, (node, is_leaf) in mapping.items():
+                input_gradient = Graph._get_gradient(gradient, input_index)
+                # Input is not differentiable (e.g. integer labels)
+                if input_gradient is None:
+                    continue
+                if is_leaf:
+                    # Parameters accumulate gradients themselves
+                    node.backward(input_gradient)
+                else:
+                    self._accumulate(gradients, node, input_gradient)
+
+        if unreached:
+            warnings.warn(
+                f"{unreached} recorded operation(s) do not contribute to the loss "
+                "and were dropped, run them inside `no_grad()`.",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+
+
+def _output_collected(graph, index, _) -> None:
+    """Drop operation whose output was garbage collected (if it's unused)."""
+    graph = graph()
+    if graph is not None and graph._outputs.pop(index, None) is not None:
+        graph._drop(index)
+
+
+class _GlobalGraph(threading.local):
+    """Class used to hide global state from the main namespace.
+
+    State is thread-local: each thread records operations into it's own
+    graph and can turn recording off without affecting other threads
+    (e.g. serving predictions while another thread trains the model).
+
+    """
+
+    def __init__(self):
+        self.graph = Graph()
+        self.on = True
+        self.segment = None
+        self.profiler = None
+
+
+_state = _GlobalGraph()
+
+
+class _Segment:
+    """Operations recorded inside `checkpoint`.
+
+    Caches of these operations are dropped right after forward. Only
+    the recipe to recompute them is kept: inputs coming from outside of
+    the segment (data, parameters, outputs of earlier operations) and
+    positions of operations inside segment which produced the others.
+
+    """
+
+    def __init__(self):
+        self.operations = []
+        self._positions = {}
+
+    def record(self, operation, arguments, cast_arguments) -> None:
+        recipe = []
+        for argument, cast_argument in zip(arguments, cast_arguments):
+            producer = getattr(argument, "last_operation", None)
+            position = self._positions.get(producer)
+            if position is None:
+                recipe.append((None, cast_argument))
+            else:
+                # Produced inside segment, will be recomputed
+                recipe.append((position, None))
+        self._positions[operation] = len(self.operations)
+        self.operations.append((operation, recipe))
+        operation.cache = None
+        operation.segment = self
+
+    def recompute(self) -> None:
+        """Run forward of all operations again to recreate their caches."""
+        outputs = []
+        for operation, recipe in self.operations:
+            arguments = [
+                argument if position is None else outputs[position]
+                for position, argument in recipe
+            ]
+            outputs.append(operation.forward(*arguments))
+        self.operations, self._positions = [], {}
+
+
+class _Precision:
+    "Data types of parameters and computations, shared by all threads."
+    parameters = None
+    compute = None
+
+
+def set_default_dtype(dtype=None, compute_dtype=None) -> None:
+    """Set floating point data types used by graph.
+
+    Arguments:
+        dtype:
+            Data type of newly created Parameters (and their gradients
+            and optimizer's state), e.g. `np.float32`. `None` keeps
+            data type of the array Parameter was created from.
+        compute_dtype:
+            Data type to which floating point inputs of operations are
+            cast. Defaults to `dtype`. Use `np.float32` together with
+            `dtype=np.float64` for float32 computations on float64
+            master weights (mixed precision).
+
+    """
+    _Precision.parameters = None if dtype is None else np.dtype(dtype)
+    _Precision.compute = None if compute_dtype is None else np.dtype(compute_dtype)
+
+
+def get_default_dtype():
+    """Return data type of newly created Parameters (`None` if not set)"""
+    return _Precision.parameters
 
-class _GlobalGraph:
-    "Class used to hide global state from the main namespace."
-    graph = Graph()
-    on: bool = True
+
+def compute_dtype():
+    """Return data type operations compute in (`None` if not set)"""
+    if _Precision.compute is not None:
+        return _Precision.compute
+    return _Precision.parameters
 
 
 def get():
-    """Return global graph"""
-    return _GlobalGraph.graph
+    """Return graph of the current thread"""
+    return _state.graph
 
 
 def has_grad():
-    return _GlobalGraph.on
+    return _state.on
+
+
+def _active_profiler():
+    """Return profiler of the current thread (if profiling)"""
+    return _state.profiler
+
+
+def _segment():
+    """Return checkpointed segment operations are recorded in (if any)"""
+    return _state.segment
+
+
+@contextlib.contextmanager
+def checkpoint():
+    """Trade compute for memory by recomputing operations during backward.
+
+    Operations recorded inside do not keep their caches (activations)
+    after forward. Those are recomputed from segment's inputs once
+    backward reaches the segment. Peak memory of a training step is
+    lowered when the model is split into multiple checkpointed segments,
+    e.g. one per layer of a deep model.
+
+    Usage:
+
+        for layer in layers:
+            with checkpoint():
+                outputs = layer(outputs)
+
+    """
+    previous, _state.segment = _state.segment, _Segment()
+    try:
+        yield
+    finally:
+        _state.segment = previous
+
+
+@contextlib.contextmanager
+def scope():
+    """Run code with new, isolated graph which is dropped afterwards.
+
+    Operations and parameters created inside are not registered in
+    the global graph, hence repeatedly building models (e.g. in a server
+    loop) does not grow memory.
+
+    Usage:
+
+        with scope():
+            model = LinearRegression(...)
+            model.fit(X, y)
+
+    """
+    previous, graph = _state.graph, Graph()
+    _state.graph = graph
+    try:
+        yield graph
+    finally:
+        graph.clear()
+        _state.graph = previous
 
 
 @contextlib.contextmanager
 def no_grad():
-    _GlobalGraph.on = False
-    yield
-    _GlobalGraph.on = True
+    """Turn off recording of operations in the current thread.
+
+    Can be nested, previous state is restored on exit (even on error).
+
+    """
+    previous, _state.on = _state.on, False
+    try:
+        yield
+    finally:
+        _state.on = previous
@@ -12,11 +12,13 @@ backpropagation. This approach allows us to simply use ops like this:
 """
 
 import abc
+import time
 
 import numpy as np
+from scipy import sparse
 
-from ._graph import get, has_grad
-from ._parameter import Parameter
+from ._graph import _active_profiler, _segment, compute_dtype, get, has_grad
+from ._parameter import _OPERATIONS, Parameter, _reduce_to_shape
 
 
 class Operation(abc.ABC):
@@ -27,7 +29,15 @@ class Operation(abc.ABC):
             Cache attribute one can use to save anything during forward pass
             to reuse in backward
         index_in_graph (int):
-            Index of operation in graph's operation dictionary
+            Index of operation on graph's tape
+        segment (Optional[_Segment]):
+            Checkpointed segment this operation was recorded in, if any
+            (see `checkpoint`). Cache is recomputed during backward.
+        requires_gradient (Optional[Tuple[bool]]):
+            Whether gradient will be propagated to each input (only
+            Parameters and outputs of other operations need one). Set
+            when operation is registered in graph, `backward` may
+            return `None` for inputs which do not require gradient.
         is_leaf (bool):
             Always `False`, used by graph to easily discern between parameters
             and operations.
@@ -36,6 +46,8 @@ class Operation(abc.ABC):
     def __init__(self):
         self.cache = None
         self.index_in_graph = None
+        self.requires_gradient = None
+        self.segment = None
         self.is_leaf = False
 
     def __call__(self, *arguments):
@@ -45,33 +57,75 @@ class Operation(abc.ABC):
         whether those are leafs (parameters) or operations to be further
         backpropagated.
 
+        Output of registered operation is marked with this operation so any
+        operation consuming it knows where to send it's gradient.
+        Inputs are never modified, hence the same Parameter may be used
+        by any number of operations.
+
         """
+        profiler = _active_profiler()
+        if profiler is None:
+            return self._call(arguments)
+        start = time.perf_counter()
+        output = self._call(arguments)
+        profiler.record(self, "forward", start, time.perf_counter(), arguments)
+        return output
+
+    def _call(self, arguments):
         if has_grad():
             mapping = {}
-            add_to_graph = False
             for input_index, argument in enumerate(arguments):
                 if isinstance(argument, Parameter):
-                    add_to_graph = True
-                    is_first_operation = argument.last_operation_index is None
-                    if is_first_operation:
-                        mapping[input_index] = (argument.index_in_graph, True)
+                    producer = argument.last_operation
+                    if producer is None:
+                        if argument.index_in_graph is None:
+                            raise ValueError(
+                                "Array derived from Parameter (e.g. a view like "
+                                "`W.T`) is not registered in graph and would not "
+                                "receive gradient, use graph operations instead."
+                            )
+                        mapping[input_index] = (argument, True)
+                    elif get()._is_recorded(producer):
+                        mapping[input_index] = (producer.index_in_graph, False)
                     else:
-                        mapping[input_index] = (argument.last_operation_index, False)
-
-            if add_to_graph:
-                self.index_in_graph = get()._register_operation(self, mapping)
-                for argument in arguments:
-                    if isinstance(argument, Parameter):
-                        argument.last_operation_index = self.index_in_graph
+                        raise ValueError(
+                            "Output of operation which was already backpropagated "
+                            "(or recorded in another graph) cannot receive "
+                            "gradient, recompute it or pass `np.asarray(...)`."
+                        )
+
+            if mapping:
+                self.requires_gradient = tuple(
+                    index in mapping for index in range(len(arguments))
+                )
+                cast_arguments = _cast(arguments)
+                output = _as_node(self.forward(*cast_arguments))
+                self.index_in_graph = get()._register_operation(self, mapping, output)
+                output.last_operation = self
+                segment = _segment()
+                if segment is not None:
+                    segment.record(self, arguments, cast_arguments)
+                return output
+
+        return self.forward(*_cast(arguments))
+
+    def _needs_gradient(self, input_index) -> bool:
+        """Whether gradient of input at `input_index` has to be calculated.
+
+        Always `True` if operation was not registered in graph (e.g. when
+        `backward` is called manually).
 
-        # Pack return value in tuple always
-        return self.forward(*arguments)
+        """
+        return self.requires_gradient is None or self.requires_gradient[input_index]
 
     @abc.abstractmethod
     def forward(self, *_):
         """Define your forward pass here.
 
         Use self.cache to cache anything needed during backpropagation.
+        Cache is kept until backward, so store as little as possible
+        (e.g. shapes and scalars instead of arrays which can be recreated
+        by broadcasting).
 
         """
         pass
@@ -81,12 +135,45 @@ class Operation(abc.ABC):
         """Define your backward pass here.
 
         Use self.cache in order to calculate gradient. There has to be as
-        many outputs as there was inputs to forward.
+        many outputs as there was inputs to forward, `None` can be
+        returned for inputs which do not need gradient (see
+        `_needs_gradient`). Cache is cleared after backward, hence arrays
+        stored in it can be reused in place.
+
+        Upstream gradient may be a read-only (broadcasted) array and
+        must not be modified.
 
         """
         pass
 
 
+def _cast_argument(argument, dtype):
+    if isinstance(argument, np.ndarray):
+        if dtype is not None and argument.dtype.kind == "f":
+            return np.asarray(argument, dtype=dtype)
+        # Plain arrays are not recorded when used inside forward
+        return np.asarray(argument)
+    if sparse.issparse(argument) and dtype is not None and argument.dtype.kind == "f":
+        return argument.astype(dtype, copy=False)
+    return argument
+
+
+def _cast(arguments):
+    """Cast floating point arrays to data type set by `set_default_dtype`.
+
+    Parameters are passed to forward as plain `np.ndarray` views, so
+    arithmetic inside operations is never recorded in graph.
+
+    """
+    dtype = compute_dtype()
+    return tuple(_cast_argument(argument, dtype) for argument in arguments)
+
+
+def _as_node(output):
+    """Wrap output of recorded operation so it can point to this operation."""
+    return np.asarray(output).view(Parameter)
+
+
 ###############################################################################
 #
 #                           BASIC MATH OPERATIONS
@@ -94,18 +181,131 @@ class Operation(abc.ABC):
 ###############################################################################
 
 
+def _unbroadcast(gradient, shape):
+    """Return gradient of input with `shape` broadcasted by elementwise op."""
+    gradient = np.asarray(gradient)
+    if gradient.shape == shape:
+        return gradient
+    if gradient.ndim == 0:
+        return np.broadcast_to(gradient, shape)
+    return _reduce_to_shape(gradient, shape)
+
+
 class _Add(Operation):
     def forward(self, a, b):
+        self.cache = (np.shape(a), np.shape(b))
+        if sparse.issparse(a) or sparse.issparse(b):
+            # scipy returns np.matrix when adding dense to sparse
+            return np.asarray(a + b)
         return a + b
 
     def backward(self, upstream_gradient):
-        return upstream_gradient, upstream_gradient
+        a_shape, b_shape = self.cache
+        return (
+            _unbroadcast(upstream_gradient, a_shape),
+            _unbroadcast(upstream_gradient, b_shape),
+        )
 
 
 def add(a, b):
     return _Add()(a, b)
 
 
+class _Subtract(Operation):
+    def forward(self, a, b):
+        self.cache = (np.shape(a), np.shape(b))
+        return a - b
+
+    def backward(self, upstream_gradient):
+        a_shape, b_shape = self.cache
+        b_gradient = None
+        if self._needs_gradient(1):
+            b_gradient = _unbroadcast(np.negative(upstream_gradient), b_shape)
+        return _unbroadcast(upstream_gradient, a_shape), b_gradient
+
+
+def subtract(a, b):
+    return _Subtract()(a, b)
+
+
+class _Multiply(Operation):
+    def forward(self, a, b):
+        # Each input is only needed for the gradient of the other one
+        self.cache = (
+            a if self._needs_gradient(1) else None,
+            b if self._needs_gradient(0) else None,
+            np.shape(a),
+            np.shape(b),
+        )
+        return a * b
+
+    def backward(self, upstream_gradient):
+        a, b, a_shape, b_shape = self.cache
+        a_gradient, b_gradient = None, None
+        if self._needs_gradient(0):
+            a_gradient = _unbroadcast(upstream_gradient * b, a_shape)
+        if self._needs_gradient(1):
+            b_gradient = _unbroadcast(upstream_gradient * a, b_shape)
+        return a_gradient, b_gradient
+
+
+def multiply(a, b):
+    return _Multiply()(a, b)
+
+
+class _Divide(Operation):
+    def forward(self, a, b):
+        self.cache = (a if self._needs_gradient(1) else None, b, np.shape(a))
+        return a / b
+
+    def backward(self, upstream_gradient):
+        a, b, a_shape = self.cache
+        a_gradient, b_gradient = None, None
+        if self._needs_gradient(0):
+            a_gradient = _unbroadcast(upstream_gradient / b, a_shape)
+        if self._needs_gradient(1):
+            b_gradient = _unbroadcast(
+                np.negative(upstream_gradient) * a / np.square(b), np.shape(b)
+            )
+        return a_gradient, b_gradient
+
+
+def divide(a, b):
+    return _Divide()(a, b)
+
+
+class _Negative(Operation):
+    def forward(self, inputs):
+        return np.negative(inputs)
+
+    def backward(self, upstream_gradient):
+        return np.negative(upstream_gradient)
+
+
+def negative(inputs):
+    return _Negative()(inputs)
+
+
+class _Sum(Operation):
+    def __init__(self, axis: int = None):
+        super().__init__()
+        self.axis = axis
+
+    def forward(self, inputs):
+        self.cache = np.shape(inputs)
+        return np.sum(inputs, axis=self.axis)
+
+    def backward(self, upstream_gradient):
+        gradient = np.asarray(upstream_gradient)
+        if self.axis is not None:
+            gradient = np.expand_dims(gradient, self.axis)
+        return np.broadcast_to(gradient, self.cache)
+
+
+def sum(inputs, axis: int = None):
+    return _Sum(axis)(inputs)
+
+
 class _Mean(Operation):
     def __init__(self, axis: int = None):
         super().__init__()
@@ -113,12 +313,17 @@ class _Mean(Operation):
 
     def forward(self, inputs):
         mean = np.mean(inputs, axis=self.axis)
-        self.cache = np.ones_like(inputs) / inputs.size
+        # Gradient is a constant, only shape and count are needed to recreate it
+        self.cache = (np.shape(inputs), np.size(inputs) // max(np.size(mean), 1))
         return mean
 
     def backward(self, upstream_gradient):
-        grad = upstream_gradient * self.cache
-        return grad
+        shape, count = self.cache
+        gradient = np.asarray(upstream_gradient) / count
+        if self.axis is not None:
+            # Reduced axes are restored so gradient broadcasts over them
+            gradient = np.expand_dims(gradient, self.axis)
+        return np.broadcast_to(gradient, shape)
 
 
 def mean(inputs, axis: int = None):
@@ -126,21 +331,126 @@ def mean(inputs, axis: int = None):
 
 
 class _Dot(Operation):
+    """Matrix product following `np.matmul` semantics.
+
+    Works for any shapes accepted by `@`, e.g. `(N, D) @ (D,)`,
+    `(N, D) @ (D, K)` or stacks of matrices. Gradient is calculated only
+    for inputs which require it, so data (e.g. `X`) costs nothing during
+    backward.
+
+    First operand may be a `scipy.sparse` matrix (e.g. CSR features),
+    in which case gradient of second operand is a sparse-dense product
+    and nothing is densified.
+
+    """
+
     def forward(self, a, b):
-        self.cache = (a, b)
-        return a @ b
+        output = a @ b
+        self.cache = (a, b, np.shape(output))
+        return output
 
-    # Needs automatic reshape in order to work
     def backward(self, upstream_gradient):
-        a = np.dot(upstream_gradient.reshape(-1, 1), self.cache[1].reshape(1, -1))
-        b = np.dot(self.cache[0].T, upstream_gradient)
-        return a, b
+        a, b, output_shape = self.cache
+        a_shape, b_shape = np.shape(a), np.shape(b)
+        if sparse.issparse(a):
+            # Sparse data cannot be a Parameter, hence never requires gradient
+            gradient = np.broadcast_to(upstream_gradient, output_shape)
+            return None, _reduce_to_shape(np.asarray(a.T @ gradient), b_shape)
+
+        a, b = np.asarray(a), np.asarray(b)
+        gradient = np.broadcast_to(upstream_gradient, output_shape)
+        # 1D operands are promoted to matrices, just like matmul does
+        if len(b_shape) == 1:
+            b = b[:, np.newaxis]
+            gradient = gradient[..., np.newaxis]
+        if len(a_shape) == 1:
+            a = a[np.newaxis, :]
+            gradient = gradient[..., np.newaxis, :]
+
+        a_gradient, b_gradient = None, None
+        if self._needs_gradient(0):
+            a_gradient = gradient @ np.swapaxes(b, -1, -2)
+            if len(a_shape) == 1:
+                a_gradient = a_gradient[..., 0, :]
+            a_gradient = _reduce_to_shape(a_gradient, a_shape)
+        if self._needs_gradient(1):
+            b_gradient = np.swapaxes(a, -1, -2) @ gradient
+            if len(b_shape) == 1:
+                b_gradient = b_gradient[..., 0]
+            b_gradient = _reduce_to_shape(b_gradient, b_shape)
+        return a_gradient, b_gradient
 
 
 def dot(a, b):
     return _Dot()(a, b)
 
 
+class _Exp(Operation):
+    def forward(self, inputs):
+        # Derivative of exp is exp itself, output is cached instead of input
+        self.cache = np.exp(inputs)
+        return self.cache
+
+    def backward(self, upstream_gradient):
+        return upstream_gradient * self.cache
+
+
+def exp(inputs):
+    return _Exp()(inputs)
+
+
+class _Log(Operation):
+    def forward(self, inputs):
+        self.cache = inputs
+        return np.log(inputs)
+
+    def backward(self, upstream_gradient):
+        return upstream_gradient / self.cache
+
+
+def log(inputs):
+    return _Log()(inputs)
+
+
+class _Square(Operation):
+    def forward(self, inputs):
+        self.cache = inputs
+        return np.square(inputs)
+
+    def backward(self, upstream_gradient):
+        return 2 * self.cache * upstream_gradient
+
+
+def square(inputs):
+    return _Square()(inputs)
+
+
+class _Sqrt(Operation):
+    def forward(self, inputs):
+        self.cache = np.sqrt(inputs)
+        return self.cache
+
+    def backward(self, upstream_gradient):
+        return upstream_gradient / (2 * self.cache)
+
+
+def sqrt(inputs):
+    return _Sqrt()(inputs)
+
+
+class _Tanh(Operation):
+    def forward(self, inputs):
+        self.cache = np.tanh(inputs)
+        return self.cache
+
+    def backward(self, upstream_gradient):
+        return upstream_gradient * (1 - np.square(self.cache))
+
+
+def tanh(inputs):
+    return _Tanh()(inputs)
+
+
 ###############################################################################
 #
 #                       ACTIVATIONS & ADVANCED MATH
@@ -161,6 +471,8 @@ def _positive_sigmoid(inputs):
 
 
 def sigmoid(inputs):
+    # Not recorded in graph, use `bce_with_logits` for training
+    inputs = np.asarray(inputs)
     positive = inputs >= 0
     # Boolean array inversion is faster than another comparison
     negative = ~positive
@@ -185,6 +497,7 @@ def sigmoid(inputs):
 
 
 def softmax(logits):
+    logits = np.asarray(logits)
     exps = np.exp(logits - np.max(logits, axis=1).reshape(-1, 1))
     return exps / np.sum(exps, axis=1).reshape(-1, 1)
 
@@ -199,11 +512,17 @@ def softmax(logits):
 class _SquaredError(Operation):
     def forward(self, logits, targets):
         self.cache = logits - targets
-        return self.cache ** 2
+        return np.square(self.cache)
 
     def backward(self, upstream_gradient):
-        gradient = 2 * self.cache * upstream_gradient
-        return gradient, -gradient
+        # Residual is not needed after backward, reuse it for gradient
+        gradient = self.cache
+        gradient *= 2
+        gradient *= upstream_gradient
+        return (
+            gradient if self._needs_gradient(0) else None,
+            -gradient if self._needs_gradient(1) else None,
+        )
 
 
 def squared_error(a, b):
@@ -227,7 +546,13 @@ class _BCEWithLogits(Operation):
         )
 
     def backward(self, upstream_gradient):
-        return sigmoid(self.cache[0]) - self.cache[1], -self.cache[0]
+        logits, targets = self.cache
+        logits_gradient, targets_gradient = None, None
+        if self._needs_gradient(0):
+            logits_gradient = (sigmoid(logits) - targets) * upstream_gradient
+        if self._needs_gradient(1):
+            targets_gradient = -logits * upstream_gradient
+        return logits_gradient, targets_gradient
 
 
 def bce_with_logits(logits, targets):
@@ -242,9 +567,13 @@ def bce_with_logits(logits, targets):
 
 
 def to_one_hot(labels, max_labels: int = None):
+    labels = np.asarray(labels)
     if max_labels is None:
         max_labels = np.max(labels) + 1
-    return np.eye(max_labels)[labels]
+    # Scatter ones instead of indexing `np.eye`, which is max_labels x max_labels
+    one_hot = np.zeros(labels.shape + (max_labels,))
+    np.put_along_axis(one_hot, labels[..., np.newaxis], 1, axis=-1)
+    return one_hot
 
 
 def to_labels(one_hot):
@@ -252,23 +581,56 @@ def to_labels(one_hot):
 
 
 class _CrossEntropyWithLogits(Operation):
+    """Softmax followed by cross entropy fused into single operation.
+
+    Works directly on integer labels. Loss is calculated via log-sum-exp
+    trick, which is numerically stable, and only softmax probabilities are
+    cached. Gradient w.r.t. logits is `probabilities - one_hot`, one hot
+    matrix is never created as only the target column has to be corrected.
+
+    Labels are not differentiable, hence no gradient is returned for them.
+
+    """
+
     def forward(self, logits, targets):
-        softmaxed = softmax(logits) + 1e-100
-        one_hot = to_one_hot(targets)
-        self.cache = (softmaxed, one_hot)
-        return -np.sum(one_hot * np.log(softmaxed), axis=1)
+        logits = np.asarray(logits)
+        rows = np.arange(logits.shape[0])
+        shifted = logits - np.max(logits, axis=1, keepdims=True)
+        probabilities = np.exp(shifted)
+        normalizer = np.sum(probabilities, axis=1, keepdims=True)
+        probabilities /= normalizer
+        self.cache = (probabilities, targets)
+        return np.log(normalizer[:, 0]) - shifted[rows, targets]
 
     def backward(self, upstream_gradient):
-        expanded_output = upstream_gradient.reshape(-1, 1)
-        return (
-            -expanded_output * np.log(self.cache[0]),
-            expanded_output
-            * (
-                self.cache[0] * np.expand_dims(np.sum(self.cache[1], axis=1), axis=1)
-                - self.cache[1]
-            ),
-        )
+        probabilities, targets = self.cache
+        # Cache is cleared after backward, probabilities can be reused in place
+        gradient = probabilities
+        gradient[np.arange(gradient.shape[0]), targets] -= 1
+        gradient *= np.reshape(upstream_gradient, (-1, 1))
+        return gradient, None
 
 
 def ce_with_logits(logits, targets):
     return _CrossEntropyWithLogits()(logits, targets)
+
+
+# Parameters dispatch `numpy` ufuncs and reductions to operations above
+_OPERATIONS.update(
+    {
+        np.add: add,
+        np.subtract: subtract,
+        np.multiply: multiply,
+        np.true_divide: divide,
+        np.negative: negative,
+        np.matmul: dot,
+        np.dot: dot,
+        np.exp: exp,
+        np.log: log,
+        np.square: square,
+        np.sqrt: sqrt,
+        np.tanh: tanh,
+        "sum": sum,
+        "mean": mean,
+    }
+)
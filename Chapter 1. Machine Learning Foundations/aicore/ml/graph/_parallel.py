@@ -0,0 +1,143 @@
+"""Data-parallel training of graph models on multiple processes.
+
+Every batch is split into `n_jobs` shards, each worker process calculates
+gradient of model's loss on it's shard with regular graph operations and
+gradients are summed (all-reduced) in the main process, where optimizer
+makes a single step. Data is copied once into shared memory, workers only
+receive current parameters and indices of their shard.
+
+"""
+
+import ctypes
+import multiprocessing
+
+import numpy as np
+from scipy import sparse
+
+from ._graph import get
+
+# State of worker process, populated by `_initialize`
+_worker = {}
+
+
+def _to_shared(array):
+    """Copy array into shared memory, return it with what's needed to view it."""
+    array = np.ascontiguousarray(array)
+    buffer = multiprocessing.RawArray(ctypes.c_char, max(array.nbytes, 1))
+    shared = np.frombuffer(buffer, dtype=array.dtype, count=array.size)
+    shared = shared.reshape(array.shape)
+    shared[...] = array
+    return shared, (buffer, array.dtype, array.shape)
+
+
+def _from_shared(buffer, dtype, shape):
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _initialize(model, X, y_true):
+    _worker["model"] = model
+    _worker["X"] = _from_shared(*X)
+    _worker["y_true"] = _from_shared(*y_true)
+
+
+def _shard_gradient(task):
+    """Return loss and gradients of model on shard summed over it's samples."""
+    values, indices = task
+    model = _worker["model"]
+    parameters = model.parameters()
+    for parameter, value in zip(parameters, values):
+        np.copyto(parameter, value)
+
+    samples = _size(indices)
+    # Loss is mean over samples, weighting by shard size makes gradients summable
+    loss = model._loss(_worker["X"][indices], _worker["y_true"][indices])
+    get().backward()
+    gradients = []
+    for parameter in parameters:
+        gradients.append(parameter.gradient * samples)
+        parameter.zero_gradient()
+    return float(loss) * samples, gradients
+
+
+class _DataParallel:
+    """Pool of workers calculating gradients of model's shards of batches.
+
+    Model's `_loss` has to be a mean over samples, which holds for all
+    built-in models.
+
+    Attributes:
+        model (_Model):
+            Model whose parameters receive all-reduced gradients.
+        n_jobs (int):
+            Number of worker processes (and shards of each batch).
+        batch_size (Optional[int]):
+            Size of mini-batch, whole data is used in each step if `None`.
+            Data is shuffled every epoch, last batch may be smaller.
+    """
+
+    def __init__(self, model, X, y_true, batch_size: int = None, n_jobs: int = -1):
+        if sparse.issparse(X):
+            raise ValueError("Data-parallel training supports only dense arrays.")
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = multiprocessing.cpu_count()
+        self.model = model
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.n_samples = np.shape(X)[0]
+
+        # Shared data has to be kept alive as long as workers use it
+        self._X, X_buffer = _to_shared(X)
+        self._y_true, y_buffer = _to_shared(y_true)
+        self.pool = multiprocessing.Pool(
+            n_jobs, initializer=_initialize, initargs=(model, X_buffer, y_buffer)
+        )
+
+    def _shards(self):
+        """Yield per-batch list of shards (slices or sorted indices)."""
+        if self.batch_size is None:
+            bounds = np.linspace(0, self.n_samples, self.n_jobs + 1).astype(int)
+            # Contiguous shards are views of shared data, nothing is gathered
+            yield [slice(start, stop) for start, stop in zip(bounds, bounds[1:])]
+            return
+
+        permutation = np.random.permutation(self.n_samples)
+        for start in range(0, self.n_samples, self.batch_size):
+            batch = permutation[start : start + self.batch_size]
+            # Sorted indices gather rows in memory order, sum does not change
+            yield [np.sort(shard) for shard in np.array_split(batch, self.n_jobs)]
+
+    def epoch(self):
+        """Yield `(loss, samples)` after gradients of each batch are set.
+
+        Gradients are written into model's parameters (in place, so
+        `ParameterArena` buffers are kept), optimizer step is left to caller.
+
+        """
+        parameters = self.model.parameters()
+        for shards in self._shards():
+            values = [np.asarray(parameter) for parameter in parameters]
+            shards = [shard for shard in shards if _size(shard) > 0]
+            if not shards:
+                continue
+            results = self.pool.map(_shard_gradient, [(values, s) for s in shards])
+            samples = sum(_size(shard) for shard in shards)
+
+            total_loss = sum(loss for loss, _ in results)
+            for index, parameter in enumerate(parameters):
+                gradient = sum(gradients[index] for _, gradients in results)
+                gradient /= samples
+                if parameter.gradient is None:
+                    parameter.gradient = gradient
+                else:
+                    np.copyto(parameter.gradient, gradient)
+            yield total_loss / samples, samples
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+
+def _size(shard) -> int:
+    if isinstance(shard, slice):
+        return shard.stop - shard.start
+    return len(shard)
@@ -1,8 +1,52 @@
-import itertools
+import functools
 
 import numpy as np
 
-from ._graph import get
+from ._graph import get, get_default_dtype, has_grad
+
+# Graph operations indexed by `numpy` ufunc (or method name) they implement,
+# populated by `_operations` so `Parameter` can record natural `numpy` code
+_OPERATIONS = {}
+
+
+@functools.lru_cache(maxsize=256)
+def _broadcast_axes(gradient_shape, data_shape):
+    """Return axes of gradient which were created by broadcasting data.
+
+    Follows `numpy` broadcasting rules: dimensions are aligned from the right,
+    leading dimensions missing in data and `1` dimensions of data stretched
+    to gradient's size were broadcasted.
+
+    Cached as the same pair of shapes is seen on every training step.
+
+    """
+    leading = len(gradient_shape) - len(data_shape)
+    if leading < 0:
+        # Same elements laid out differently only need a reshape
+        if np.prod(gradient_shape) == np.prod(data_shape):
+            return ()
+        raise ValueError(
+            "Data has more dimension than gradient, something went very wrong."
+        )
+
+    axes = list(range(leading))
+    for index, (data_size, gradient_size) in enumerate(
+        zip(data_shape, gradient_shape[leading:]), start=leading
+    ):
+        if data_size == gradient_size:
+            continue
+        if data_size != 1:
+            raise ValueError("Data has more elements than it's gradient")
+        axes.append(index)
+    return tuple(axes)
+
+
+def _reduce_to_shape(gradient, shape):
+    """Sum broadcasted dimensions of gradient so it has exactly `shape`."""
+    axes = _broadcast_axes(gradient.shape, shape)
+    if axes:
+        gradient = np.sum(gradient, axis=axes, keepdims=True)
+    return gradient.reshape(shape)
 
 
 # https://numpy.org/doc/stable/user/basics.subclassing.html
@@ -12,23 +56,39 @@ class Parameter(np.ndarray):
     Attributes:
         gradient (Optional[np.array]):
             Array with gradients with which parameter can be optimized via
-            optimizer
-        index_in_graph (int):
-            Index of parameter in graph's list
+            optimizer. Allocated once during first `backward` and accumulated
+            into afterwards, optimizer zeroes it in place after each step.
+        index_in_graph (Optional[int]):
+            Index of parameter in graph's registry, `None` for arrays derived
+            from parameter (e.g. views) which are not registered
         is_leaf (bool):
             Always True, used by graph to easily discern between parameters
             and operations.
+        last_operation (Optional[Operation]):
+            Operation which produced this array. Gradient is sent to it
+            only while it is recorded on the current graph's tape (until
+            `backward` or `clear`). `None` for parameters created by user
+            (leaves) and arrays derived from parameters.
+        shares_gradient (bool):
+            Whether `gradient` is a view of buffer shared with other
+            parameters (see `ParameterArena`). Such gradient cannot be
+            reassigned and `clear` only zeroes it.
     """
 
-    def __new__(cls, input_array):
+    def __new__(cls, input_array, dtype=None):
         # Input array is an already formed ndarray instance
         # We first cast to be our class type
-        obj = np.asarray(input_array).view(cls)
+        obj = np.asarray(input_array)
+        if dtype is None and obj.dtype.kind == "f":
+            # Floating point parameters follow `set_default_dtype`
+            dtype = get_default_dtype()
+        obj = np.asarray(obj, dtype=dtype).view(cls)
         # Gradient is None until populated
+        obj.shares_gradient = False
         obj.gradient = None
         obj.index_in_graph = get()._register_parameter(obj)
         obj.is_leaf = True
-        obj.last_operation_index = None
+        obj.last_operation = None
         # Return newly created object
         return obj
 
@@ -41,48 +101,192 @@ class Parameter(np.ndarray):
         """
         if obj is None:
             return
-        self.gradient = getattr(obj, "gradient", None)
-        self.index_in_graph = getattr(obj, "index_in_graph", None)
+        # Gradient buffer, registration and producing operation belong to
+        # the parameter (or node), not to arrays derived from it (views,
+        # reshapes), which would otherwise receive gradient of the whole
+        self.shares_gradient = False
+        self.gradient = None
+        self.index_in_graph = None
         self.is_leaf = getattr(obj, "is_leaf", True)
-        self.last_operation_index = getattr(obj, "last_operation_index", None)
+        self.last_operation = None
 
-    def broadcast_fix(self, gradient):
-        """Try to fix numpy's broadcasting with gradient.
+    def __reduce__(self):
+        # Pickled (e.g. sent to worker process) as a new leaf parameter
+        return Parameter, (np.asarray(self), self.dtype)
 
-        `1` dimensions may be broadcasted to other automatically. There is no
-        clear way to know about that which could be easily implemented.
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        """Record supported ufuncs (and operators) in graph.
 
-        Broadcasting is equal to summing all the values, hence __any__ dimension
-        which might be off in gradient is summed by the function below.
+        `W * 2`, `np.exp(W)` or `X @ W` (and `np.dot(X, W)`, see
+        `__array_function__`) are run by corresponding graph operations
+        while gradient is recorded, hence gradient flows through them.
+        Other differentiable ufuncs (e.g. `np.maximum`, `abs` or reductions
+        like `W.max()`) applied to recorded arrays raise `TypeError` while
+        recording, as their result would silently be a constant for the
+        graph. Run them inside `no_grad` or on `np.asarray(W)`.
+
+        Ufuncs which are not differentiable (comparisons, `np.sign`...),
+        in-place calls (`out=`), calls with no recording and arrays derived
+        from parameters (e.g. `W[:2] * 2`), which are not registered in
+        graph, are run by `numpy` directly and return plain `np.ndarray`.
+
+        Products computed by `scipy.sparse` (`csr @ W`) do not reach
+        `numpy` either and return plain `np.ndarray`, use `dot(csr, W)`.
 
         """
-        if not isinstance(gradient, np.ndarray):
-            return gradient
+        recorded = (
+            out is None
+            and has_grad()
+            and any(_in_graph(argument) for argument in inputs)
+        )
+        if recorded and method == "__call__" and not kwargs:
+            operation = _OPERATIONS.get(ufunc)
+            if operation is not None:
+                return operation(*inputs)
 
-        if gradient.flatten().shape == self.flatten().shape:
-            return gradient
-        flattened_gradient = gradient.flatten()
-        flattened_data = self.flatten()
-        if len(flattened_gradient.shape) < len(flattened_data.shape):
-            raise ValueError(
-                "Data has more dimension than gradient, something went very wrong."
+        inputs = tuple(
+            np.asarray(argument) if isinstance(argument, Parameter) else argument
+            for argument in inputs
+        )
+        if out is not None:
+            kwargs["out"] = tuple(
+                np.asarray(array) if isinstance(array, Parameter) else array
+                for array in out
+            )
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if out is not None:
+            return out[0] if len(out) == 1 else out
+        if recorded and ufunc not in _PIECEWISE_CONSTANT and _is_inexact(result):
+            _raise_unrecorded(
+                ufunc.__name__ + ("" if method == "__call__" else "." + method)
             )
+        return result
 
-        to_sum = []
-        # Gradient cannot be None as the condition is checked above
-        for index, (data_shape, gradient_shape) in enumerate(
-            itertools.zip_longest(flattened_data.shape, flattened_gradient.shape)
+    def __array_function__(self, function, types, args, kwargs):
+        # `np.dot` is not a ufunc, the rest is built on ufuncs and methods
+        operation = _OPERATIONS.get(function)
+        if (
+            operation is not None
+            and not kwargs
+            and has_grad()
+            and any(_in_graph(argument) for argument in args)
         ):
-            if data_shape is None or gradient_shape > data_shape:
-                to_sum.append(index)
-            if data_shape > gradient_shape:
-                raise ValueError("Data has more elements than it's gradient")
-        return np.sum(flattened_gradient, axis=tuple(to_sum)).flatten()
+            return operation(*args)
+        return super().__array_function__(function, types, args, kwargs)
+
+    def __array_wrap__(self, array, context=None, return_scalar=False):
+        """Return results of `numpy` functions as plain `np.ndarray`.
+
+        Used by functions which retry on plain array after
+        `__array_ufunc__` raised (e.g. `np.clip` or `np.cumsum`), hence
+        the same rules apply.
+
+        """
+        if has_grad() and _in_graph(self) and _is_inexact(array):
+            _raise_unrecorded("Function")
+        array = np.asarray(array)
+        return array[()] if return_scalar else array
+
+    def sum(self, axis=None, dtype=None, out=None, **kwargs):
+        if dtype is None and out is None and not kwargs and has_grad():
+            if _in_graph(self):
+                return _OPERATIONS["sum"](self, axis=axis)
+            return np.asarray(self).sum(axis=axis)
+        return super().sum(axis=axis, dtype=dtype, out=out, **kwargs)
+
+    def mean(self, axis=None, dtype=None, out=None, **kwargs):
+        if dtype is None and out is None and not kwargs and has_grad():
+            if _in_graph(self):
+                return _OPERATIONS["mean"](self, axis=axis)
+            return np.asarray(self).mean(axis=axis)
+        return super().mean(axis=axis, dtype=dtype, out=out, **kwargs)
+
+    @property
+    def gradient(self):
+        return self._gradient
+
+    @gradient.setter
+    def gradient(self, gradient):
+        if self.shares_gradient and gradient is not self._gradient:
+            raise ValueError(
+                "Gradient is a view of shared buffer (e.g. `ParameterArena`) "
+                "and cannot be reassigned, use `zero_gradient` instead."
+            )
+        self._gradient = gradient
+
+    def broadcast_fix(self, gradient):
+        """Fix numpy's broadcasting with gradient.
+
+        `1` dimensions (and missing leading dimensions) may be broadcasted to
+        other automatically, which is equal to summing all the values. Hence
+        every broadcasted dimension of gradient is summed and the result
+        has exactly the same shape as the parameter.
+
+        """
+        if not isinstance(gradient, np.ndarray):
+            return gradient
+
+        if gradient.shape == self.shape:
+            return gradient
+        return _reduce_to_shape(gradient, self.shape)
 
     def backward(self, upstream_gradient) -> None:
-        """Take upstream gradient and update param's gradient with it."""
-        self.gradient = self.broadcast_fix(upstream_gradient)
+        """Take upstream gradient and accumulate it in param's gradient.
+
+        Parameter used by multiple operations receives gradient from each
+        of them, those are summed into the same buffer.
+
+        """
+        if self.gradient is None:
+            self.gradient = np.zeros(self.shape, dtype=self.dtype)
+        self.gradient += self.broadcast_fix(upstream_gradient)
+
+    def zero_gradient(self) -> None:
+        """Zero gradient in place so the buffer is reused in next step."""
+        if self.gradient is not None:
+            self.gradient.fill(0)
 
     def clear(self) -> None:
-        """Clear gradient to save RAM memory."""
-        self.gradient = None
+        """Clear gradient to save RAM memory.
+
+        Shared gradient (see `shares_gradient`) is kept and zeroed instead.
+
+        """
+        if self.shares_gradient:
+            self.zero_gradient()
+        else:
+            self.gradient = None
+
+
+# Differentiable almost everywhere with zero gradient, safe to treat as constant
+_PIECEWISE_CONSTANT = frozenset(
+    (np.sign, np.floor, np.ceil, np.trunc, np.rint, np.floor_divide)
+)
+
+
+def _is_inexact(result) -> bool:
+    """Whether ufunc's result (or any of it's results) is floating point."""
+    if isinstance(result, tuple):
+        return any(_is_inexact(array) for array in result)
+    return np.issubdtype(np.result_type(result), np.inexact)
+
+
+def _raise_unrecorded(name: str):
+    raise TypeError(
+        f"{name} has no graph operation and would not propagate gradient, "
+        "run it inside `no_grad()` or on `np.asarray(...)`."
+    )
+
+
+def _in_graph(argument) -> bool:
+    """Whether argument is registered parameter or output of recorded operation.
+
+    Outputs of operations which were already backpropagated (or cleared)
+    are constants, just like plain arrays.
+
+    """
+    if not isinstance(argument, Parameter):
+        return False
+    if argument.last_operation is None:
+        return argument.index_in_graph is not None
+    return get()._is_recorded(argument.last_operation)
@@ -0,0 +1,129 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from ._graph import _state
+
+
+def _nbytes(value, inputs=frozenset()) -> int:
+    """Return number of bytes held by arrays inside (possibly nested) value.
+
+    Arrays whose `id` is in `inputs` (forward's arguments) are owned by
+    the caller, not the cache, and are not counted.
+
+    """
+    if id(value) in inputs:
+        return 0
+    if isinstance(value, np.ndarray):
+        # Views (e.g. broadcasted arrays) do not hold any memory themselves
+        return value.nbytes if value.base is None else 0
+    if sparse.issparse(value):
+        return sum(
+            getattr(value, name).nbytes
+            for name in ("data", "indices", "indptr")
+            if hasattr(value, name)
+        )
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item, inputs) for item in value)
+    return 0
+
+
+class Profiler:
+    """Per-operation statistics gathered inside `profile` context.
+
+    Attributes:
+        stats (Dict[str, Dict[str, float]]):
+            Name of Operation subclass mapped to number of `calls`, total
+            `forward` and `backward` time in seconds and total bytes
+            of arrays owned by cache after forward (`cached_bytes`,
+            inputs of the operation and views of other arrays are not
+            counted).
+        events (Optional[List[Dict]]):
+            Chrome trace events (only if created with `trace=True`).
+    """
+
+    def __init__(self, trace: bool = False):
+        self.stats = collections.defaultdict(
+            lambda: {"calls": 0, "forward": 0.0, "backward": 0.0, "cached_bytes": 0}
+        )
+        self.events = [] if trace else None
+        self._start = time.perf_counter()
+
+    def record(
+        self, operation, phase: str, start: float, end: float, inputs=()
+    ) -> None:
+        """Record single forward or backward of operation.
+
+        `inputs` are arguments of forward, which are not counted as cached.
+
+        """
+        name = type(operation).__name__
+        stats = self.stats[name]
+        stats[phase] += end - start
+        if phase == "forward":
+            stats["calls"] += 1
+            stats["cached_bytes"] += _nbytes(
+                operation.cache, frozenset(map(id, inputs))
+            )
+        if self.events is not None:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": phase,
+                    "ph": "X",
+                    "ts": (start - self._start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": 0,
+                    "tid": threading.get_ident(),
+                }
+            )
+
+    def table(self) -> str:
+        """Return statistics as text table sorted by total time."""
+        header = f"{'Operation':<28}{'calls':>10}{'forward [ms]':>15}"
+        header += f"{'backward [ms]':>15}{'cached [MB]':>14}"
+        rows = [header, "-" * len(header)]
+        for name, stats in sorted(
+            self.stats.items(),
+            key=lambda item: item[1]["forward"] + item[1]["backward"],
+            reverse=True,
+        ):
+            rows.append(
+                f"{name:<28}{stats['calls']:>10}"
+                f"{stats['forward'] * 1e3:>15.3f}{stats['backward'] * 1e3:>15.3f}"
+                f"{stats['cached_bytes'] / 2 ** 20:>14.3f}"
+            )
+        return "\n".join(rows)
+
+    def chrome_trace(self, path) -> None:
+        """Save events as JSON loadable by `chrome://tracing` or Perfetto."""
+        if self.events is None:
+            raise ValueError("Profiler has to be created with trace=True.")
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events}, file)
+
+
+@contextlib.contextmanager
+def profile(trace: bool = False):
+    """Profile operations (forward and backward) run in the current thread.
+
+    Usage:
+
+        with profile() as profiler:
+            model.fit(X, y)
+        print(profiler.table())
+
+    Disabled profiling costs a single attribute lookup per operation.
+
+    """
+    profiler = Profiler(trace)
+    previous, _state.profiler = _state.profiler, profiler
+    try:
+        yield profiler
+    finally:
+        _state.profiler = previous
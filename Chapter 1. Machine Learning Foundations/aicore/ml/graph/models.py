@@ -1,13 +1,383 @@
+import abc
+
 import numpy as np
+from scipy import linalg, optimize, sparse
 
+from ..data import DataLoader
+from ._arena import ParameterArena
 from ._graph import get, no_grad
 from ._operations import (add, bce_with_logits, ce_with_logits, dot, mean,
-                          sigmoid, softmax, squared_error)
+                          multiply, sigmoid, softmax, squared_error)
+from ._parallel import _DataParallel
 from ._parameter import Parameter
 
 
-class LinearRegression:
-    def __init__(self, n_features, optimizer):
+###############################################################################
+#
+#                           COMPILED PREDICTORS
+#
+###############################################################################
+
+
+class LinearPredictor:
+    """Frozen, graph-free predictor returned by `compile` of a model.
+
+    Holds plain contiguous, read-only copies of model's weights, so further
+    training of the model does not affect it. Prediction is a single matrix
+    product with bias and activation applied in place, without any graph
+    bookkeeping.
+
+    Attributes:
+        W (np.array):
+            Weights of the model
+        b (np.array):
+            Bias of the model
+    """
+
+    def __init__(self, W, b, dtype=None):
+        self.W = np.array(W, dtype=dtype, order="C")
+        self.b = np.array(b, dtype=self.W.dtype, order="C")
+        self.W.flags.writeable = False
+        self.b.flags.writeable = False
+
+    def predict_logits(self, X):
+        if sparse.issparse(X):
+            X = X.astype(self.W.dtype, copy=False)
+        else:
+            X = np.asarray(X, dtype=self.W.dtype)
+        logits = X @ self.W
+        logits += self.b
+        return logits
+
+    def predict(self, X):
+        return self.predict_logits(X)
+
+
+class BinaryLogisticPredictor(LinearPredictor):
+    def predict_proba(self, X):
+        # sigmoid(x) = (1 + tanh(x / 2)) / 2 is stable and can be done in place
+        probabilities = self.predict_logits(X)
+        probabilities *= 0.5
+        np.tanh(probabilities, out=probabilities)
+        probabilities += 1
+        probabilities *= 0.5
+        return probabilities
+
+    def predict(self, X):
+        return self.predict_logits(X) > 0
+
+
+class MulticlassLogisticPredictor(LinearPredictor):
+    def predict_proba(self, X):
+        probabilities = self.predict_logits(X)
+        probabilities -= np.max(probabilities, axis=-1, keepdims=True)
+        np.exp(probabilities, out=probabilities)
+        probabilities /= np.sum(probabilities, axis=-1, keepdims=True)
+        return probabilities
+
+    def predict(self, X):
+        return np.argmax(self.predict_logits(X), axis=-1)
+
+
+###############################################################################
+#
+#                               GRAPH MODELS
+#
+###############################################################################
+
+
+class _Model(abc.ABC):
+    """Base class of models trained with graph and optimizer.
+
+    Defines `fit` which runs (mini-batch) gradient descent or one of
+    other `solvers`. Each model has to define it's `parameters` and scalar
+    `_loss` (mean over samples) calculated with graph operations.
+
+    Attributes:
+        history (Dict[str, List[float]]):
+            Per-epoch training loss (`"loss"`) and, if validation data
+            was provided to `fit`, validation loss (`"validation_loss"`).
+        arena (Optional[ParameterArena]):
+            Contiguous storage of parameters, see `use_arena`.
+        solvers (Tuple[str]):
+            Names of solvers accepted by `fit`.
+
+    """
+
+    arena = None
+    solvers = ("gd", "lbfgs")
+    _predictor = LinearPredictor
+
+    @abc.abstractmethod
+    def parameters(self):
+        pass
+
+    @abc.abstractmethod
+    def _loss(self, X, y_true):
+        pass
+
+    def use_arena(self) -> ParameterArena:
+        """Move all parameters of the model into single `ParameterArena`.
+
+        Optimizer will update the whole model in one vectorized step.
+
+        """
+        names = [
+            name for name, value in vars(self).items() if isinstance(value, Parameter)
+        ]
+        self.arena = ParameterArena(getattr(self, name) for name in names)
+        for name, parameter in zip(names, self.arena.parameters):
+            setattr(self, name, parameter)
+        return self.arena
+
+    def _optimized_parameters(self):
+        """Return what optimizer should update after each step."""
+        if self.arena is not None:
+            return self.arena.data
+        return self.parameters()
+
+    def compile(self, dtype=None) -> LinearPredictor:
+        """Export frozen predictor for fast inference.
+
+        Arguments:
+            dtype:
+                Data type of predictor's weights (e.g. `np.float32`).
+                Inputs are cast to it as well. Defaults to model's dtype.
+
+        """
+        return self._predictor(self.W, self.b, dtype=dtype)
+
+    def loss(self, X, y_true) -> float:
+        """Calculate loss without recording operations in graph."""
+        with no_grad():
+            return float(self._loss(X, y_true))
+
+    @staticmethod
+    def _batches(X, y_true, batch_size):
+        """Return iterable over `(X, y_true)` batches for single epoch."""
+        # X is already an iterable of batches, e.g. `aicore.ml.data.DataLoader`
+        if y_true is None:
+            return X
+        if batch_size is None:
+            return ((X, y_true),)
+        # Remainder is trained on as well, even if batch_size > len(X)
+        return DataLoader(X, y_true, batch_size=batch_size, drop_last=False)
+
+    def _steps(self, batches):
+        """Yield `(loss, samples)` after gradients of each batch are calculated."""
+        for X_batch, y_batch in batches:
+            # loss is our final node
+            loss = self._loss(X_batch, y_batch)
+            get().backward()
+            yield float(loss), np.shape(X_batch)[0]
+
+    def _solve_lbfgs(self, X, y_true, batch_size, epochs):
+        """Minimize loss over all batches with `scipy`'s L-BFGS.
+
+        Gradient of each batch is calculated by graph and weighted by
+        batch's size, so full loss is minimized even if data does not fit
+        into memory at once.
+
+        """
+        parameters = self.parameters()
+        sizes = [parameter.size for parameter in parameters]
+        history = {"loss": []}
+
+        def loss_and_gradient(vector):
+            for parameter, values in zip(
+                parameters, np.split(vector, np.cumsum(sizes)[:-1])
+            ):
+                np.copyto(parameter, values.reshape(parameter.shape))
+                parameter.zero_gradient()
+            total_loss, total_samples = 0.0, 0
+            for X_batch, y_batch in self._batches(X, y_true, batch_size):
+                samples = np.shape(X_batch)[0]
+                loss = multiply(self._loss(X_batch, y_batch), samples)
+                get().backward()
+                total_loss += float(loss)
+                total_samples += samples
+            if total_samples == 0:
+                raise ValueError("No samples to fit the model on.")
+            gradient = np.concatenate(
+                [np.ravel(parameter.gradient) for parameter in parameters]
+            )
+            history["last"] = total_loss / total_samples
+            return history["last"], gradient.astype(np.float64) / total_samples
+
+        result = optimize.minimize(
+            loss_and_gradient,
+            np.concatenate([np.ravel(parameter) for parameter in parameters]),
+            jac=True,
+            method="L-BFGS-B",
+            callback=lambda _: history["loss"].append(history.pop("last")),
+            options={"maxiter": epochs},
+        )
+        # Last evaluation may have been a rejected line search step,
+        # loss recorded by the last callback is replaced with the final one
+        loss_and_gradient(result.x)
+        if history["loss"]:
+            history["loss"][-1] = history.pop("last")
+        else:
+            history["loss"].append(history.pop("last"))
+        for parameter in parameters:
+            parameter.zero_gradient()
+        return history
+
+    def fit(
+        self,
+        X,
+        y_true=None,
+        epochs: int = 10,
+        batch_size: int = None,
+        validation=None,
+        patience: int = None,
+        verbose: bool = False,
+        n_jobs: int = None,
+        solver: str = "gd",
+    ):
+        """Fit model using gradient descent.
+
+        Arguments:
+            X:
+                Features or iterable of `(X, y_true)` batches (e.g.
+                `aicore.ml.data.DataLoader`) in which case `y_true`
+                should not be provided.
+            y_true:
+                Targets corresponding to `X`.
+            epochs:
+                Maximum number of passes over the data.
+            batch_size:
+                Size of mini-batch. If `None` whole `X` is used in each step.
+            validation:
+                Optional `(X, y_true)` tuple used to calculate validation
+                loss after every epoch.
+            patience:
+                Stop after this many epochs without improvement of
+                validation loss and restore best parameters.
+                Requires `validation`.
+            verbose:
+                Print losses after every epoch.
+            n_jobs:
+                Train data-parallel on this many processes (`-1` uses all
+                cores). Each batch is split between processes, their
+                gradients are summed and optimizer makes single step.
+                `X` and `y_true` have to be dense arrays, they are copied
+                into shared memory once. Consider limiting BLAS threads
+                (e.g. `OMP_NUM_THREADS=1`) so processes do not compete.
+            solver:
+                `"gd"` runs gradient descent with model's optimizer.
+                `"lbfgs"` minimizes loss over all batches with L-BFGS, running
+                at most `epochs` iterations. `LinearRegression` additionally
+                supports exact least squares solutions, see it's `solvers`.
+                Early stopping and `n_jobs` are available only for `"gd"`.
+
+        Returns:
+            `history` of per-epoch losses.
+
+        """
+        if solver not in self.solvers:
+            raise ValueError(
+                f"Unknown solver {solver!r}, {type(self).__name__} supports: "
+                + ", ".join(self.solvers)
+            )
+        if solver != "gd":
+            if patience is not None or n_jobs is not None:
+                raise ValueError(
+                    f"Solver {solver!r} supports neither patience nor n_jobs."
+                )
+            self.history = getattr(self, f"_solve_{solver}")(
+                X, y_true, batch_size=batch_size, epochs=epochs
+            )
+            if validation is not None:
+                self.history["validation_loss"] = [self.loss(*validation)]
+            if verbose:
+                print(
+                    ", ".join(
+                        f"{key}: {value[-1]}" for key, value in self.history.items()
+                    )
+                )
+            return self.history
+
+        if self.optimizer is None:
+            raise ValueError("Gradient descent requires model's optimizer.")
+        if patience is not None and validation is None:
+            raise ValueError("Early stopping requires validation data.")
+
+        self.history = {"loss": []}
+        if validation is not None:
+            self.history["validation_loss"] = []
+        best_loss, best_parameters, epochs_without_improvement = np.inf, None, 0
+
+        if n_jobs is None:
+            batches = self._batches(X, y_true, batch_size)
+            parallel = None
+        else:
+            if y_true is None:
+                raise ValueError("Data-parallel training requires X and y_true.")
+            parallel = _DataParallel(self, X, y_true, batch_size, n_jobs)
+        try:
+            for epoch in range(epochs):
+                steps = self._steps(batches) if parallel is None else parallel.epoch()
+                total_loss, total_samples = 0.0, 0
+                for loss, samples in steps:
+                    total_loss += loss * samples
+                    total_samples += samples
+                    self.optimizer(self._optimized_parameters())
+                if total_samples == 0:
+                    raise ValueError("No samples to fit the model on.")
+                self.history["loss"].append(total_loss / total_samples)
+
+                if validation is not None:
+                    validation_loss = self.loss(*validation)
+                    self.history["validation_loss"].append(validation_loss)
+                if verbose:
+                    losses = (
+                        f"{key}: {value[-1]}" for key, value in self.history.items()
+                    )
+                    print(f"Epoch {epoch}: " + ", ".join(losses))
+
+                if patience is not None:
+                    if validation_loss < best_loss:
+                        best_loss, epochs_without_improvement = validation_loss, 0
+                        best_parameters = [np.array(p) for p in self.parameters()]
+                    else:
+                        epochs_without_improvement += 1
+                        if epochs_without_improvement >= patience:
+                            break
+        finally:
+            if parallel is not None:
+                parallel.close()
+
+        if best_parameters is not None:
+            for parameter, best in zip(self.parameters(), best_parameters):
+                np.copyto(parameter, best)
+        return self.history
+
+
+class LinearRegression(_Model):
+    """Linear regression minimizing mean squared error.
+
+    Besides gradient based solvers, least squares problem can be solved
+    exactly by `fit(..., solver=...)`:
+
+        - `"cholesky"` - normal equations `(X^T X) w = X^T y` solved via
+          Cholesky factorization, fastest, requires full rank `X`
+          (may be `scipy.sparse`)
+        - `"qr"` - QR factorization of `X`, numerically more stable for
+          ill-conditioned data at higher cost, `X` has to be dense
+        - `"streaming"` - normal equations accumulated chunk by chunk
+          (`batch_size` rows of arrays or batches of an iterable such as
+          `aicore.ml.data.DataLoader`), so `X` never has to be in memory
+          at once
+
+    Solution is written into existing `W` and `b` parameters.
+
+    """
+
+    solvers = _Model.solvers + ("cholesky", "qr", "streaming")
+    _chunk_size = 65536
+
+    def __init__(self, n_features, optimizer=None):
         self.W = Parameter(np.random.randn(n_features))
         self.b = Parameter(np.random.randn(1))
         self.optimizer = optimizer
@@ -15,20 +385,91 @@ class LinearRegression:
     def parameters(self):
         return self.W, self.b
 
-    def predict(self, X):
+    def _set_solution(self, solution):
+        # Bias is the last coefficient, corresponding to column of ones
+        np.copyto(self.W, solution[:-1])
+        np.copyto(self.b, solution[-1:])
+
+    @staticmethod
+    def _normal_equations(batches):
+        """Accumulate `A^T A`, `A^T y`, `y^T y` and samples for `A = [X, 1]`."""
+        gram, moment, squares, samples = None, None, 0.0, 0
+        for X_batch, y_batch in batches:
+            if sparse.issparse(X_batch):
+                X_batch = X_batch.astype(np.float64)
+                X_gram = (X_batch.T @ X_batch).toarray()
+            else:
+                X_batch = np.asarray(X_batch, dtype=np.float64)
+                X_gram = X_batch.T @ X_batch
+            y_batch = np.asarray(y_batch, dtype=np.float64)
+            if gram is None:
+                n_features = X_batch.shape[1]
+                gram = np.zeros((n_features + 1, n_features + 1))
+                moment = np.zeros(n_features + 1)
+
+            gram[:-1, :-1] += X_gram
+            gram[:-1, -1] += np.asarray(X_batch.sum(axis=0)).ravel()
+            gram[-1, -1] += X_batch.shape[0]
+            moment[:-1] += np.asarray(X_batch.T @ y_batch).ravel()
+            moment[-1] += np.sum(y_batch)
+            squares += y_batch @ y_batch
+            samples += X_batch.shape[0]
+        if samples == 0:
+            raise ValueError("No samples to fit the model on.")
+        gram[-1, :-1] = gram[:-1, -1]
+        return gram, moment, squares, samples
+
+    def _solve_normal_equations(self, batches):
+        gram, moment, squares, samples = self._normal_equations(batches)
+        solution = linalg.cho_solve(linalg.cho_factor(gram), moment)
+        self._set_solution(solution)
+        # Mean squared error expanded, data does not have to be passed again
+        loss = (squares - 2 * solution @ moment + solution @ gram @ solution) / samples
+        # Cancellation may leave tiny negative value for (almost) exact fits
+        return {"loss": [max(0.0, float(loss))]}
+
+    def _solve_cholesky(self, X, y_true, batch_size, epochs):
+        if y_true is None:
+            raise ValueError("Use 'streaming' solver for iterable of batches.")
+        return self._solve_normal_equations(((X, y_true),))
+
+    def _solve_streaming(self, X, y_true, batch_size, epochs):
+        if y_true is None:
+            return self._solve_normal_equations(X)
+        chunk = batch_size or self._chunk_size
+        # Contiguous chunks are views, nothing is copied or shuffled
+        return self._solve_normal_equations(
+            (X[start : start + chunk], y_true[start : start + chunk])
+            for start in range(0, np.shape(X)[0], chunk)
+        )
+
+    def _solve_qr(self, X, y_true, batch_size, epochs):
+        if y_true is None or sparse.issparse(X):
+            raise ValueError("QR solver requires dense X and y_true.")
+        if np.shape(X)[0] == 0:
+            raise ValueError("No samples to fit the model on.")
+        design = np.empty((np.shape(X)[0], np.shape(X)[1] + 1))
+        design[:, :-1] = X
+        design[:, -1] = 1
+        Q, R = linalg.qr(design, mode="economic", overwrite_a=True)
+        self._set_solution(linalg.solve_triangular(R, Q.T @ np.asarray(y_true)))
+        return {"loss": [self.loss(X, y_true)]}
+
+    def _forward(self, X):
         return add(dot(X, self.W), self.b)
 
-    def fit(self, X, y_true, epochs: int = 10):
-        for _ in range(epochs):
-            y_pred = self.predict(X)
-            # loss is our final node
-            mean(squared_error(y_pred, y_true))
-            get().backward()
-            self.optimizer(self.parameters())
+    def predict(self, X):
+        with no_grad():
+            return self._forward(X)
+
+    def _loss(self, X, y_true):
+        return mean(squared_error(self._forward(X), y_true))
 
 
-class BinaryLogisticRegression:
-    def __init__(self, n_features, optimizer):
+class BinaryLogisticRegression(_Model):
+    _predictor = BinaryLogisticPredictor
+
+    def __init__(self, n_features, optimizer=None):
         self.W = Parameter(np.random.randn(n_features))
         self.b = Parameter(np.random.randn(1))
         self.optimizer = optimizer
@@ -36,28 +477,27 @@ class BinaryLogisticRegression:
     def parameters(self):
         return self.W, self.b
 
-    def predict_logits(self, X):
+    def _forward(self, X):
         return add(dot(X, self.W), self.b)
 
-    def predict_proba(self, X):
+    def predict_logits(self, X):
         with no_grad():
-            return sigmoid(self.predict_logits(X))
+            return self._forward(X)
+
+    def predict_proba(self, X):
+        return sigmoid(self.predict_logits(X))
 
     def predict(self, X):
-        with no_grad():
-            return self.predict_logits(X) > 0
+        return self.predict_logits(X) > 0
 
-    def fit(self, X, y_true, epochs: int = 10):
-        for _ in range(epochs):
-            y_pred = self.predict_logits(X)
-            # loss is our final node
-            mean(bce_with_logits(y_pred, y_true))
-            get().backward()
-            self.optimizer(self.parameters())
+    def _loss(self, X, y_true):
+        return mean(bce_with_logits(self._forward(X), y_true))
 
 
-class MulticlassLogisticRegression:
-    def __init__(self, n_classes, n_features, optimizer):
+class MulticlassLogisticRegression(_Model):
+    _predictor = MulticlassLogisticPredictor
+
+    def __init__(self, n_classes, n_features, optimizer=None):
         self.W = Parameter(np.random.randn(n_features, n_classes))
         self.b = Parameter(np.random.randn(n_classes))
         self.optimizer = optimizer
@@ -65,21 +505,18 @@ class MulticlassLogisticRegression:
     def parameters(self):
         return self.W, self.b
 
-    def predict_logits(self, X):
+    def _forward(self, X):
         return add(dot(X, self.W), self.b)
 
-    def predict_proba(self, X):
+    def predict_logits(self, X):
         with no_grad():
-            return softmax(self.predict_logits(X))
+            return self._forward(X)
+
+    def predict_proba(self, X):
+        return softmax(self.predict_logits(X))
 
     def predict(self, X):
-        with no_grad():
-            return self.predict_logits(X) > 0
+        return np.argmax(self.predict_logits(X), axis=1)
 
-    def fit(self, X, y_true, epochs: int = 10):
-        for _ in range(epochs):
-            y_pred = self.predict_logits(X)
-            # loss is our final node
-            mean(ce_with_logits(y_pred, y_true))
-            get().backward()
-            self.optimizer(self.parameters())
+    def _loss(self, X, y_true):
+        return mean(ce_with_logits(self._forward(X), y_true))
@@ -6,31 +6,82 @@ Each new optimizer should inherit from Optimizer base class.
 
 import abc
 import collections
+import functools
+import weakref
 
 import numpy as np
 
+from ._graph import no_grad
+
 
 class Optimizer(abc.ABC):
     """Base optimizer class.
 
-    Defines `__call__` which iterates over provided parameters and clears
-    their gradients afterwards.
+    Defines `__call__` which iterates over provided parameters and zeroes
+    their gradients afterwards (buffers are kept for the next step).
+    As gradient is zeroed after `forward`, optimizers may use it as
+    scratch space for in-place computations.
 
     """
 
     def __call__(self, parameters):
-        if isinstance(parameters, collections.abc.Iterable):
-            parameters = parameters
-        else:
+        # Single parameter (e.g. `ParameterArena.data`) is iterable as well
+        if isinstance(parameters, np.ndarray) or not isinstance(
+            parameters, collections.abc.Iterable
+        ):
             parameters = (parameters,)
-        for parameter in parameters:
-            self.forward(parameter)
-            parameter.gradient = None
+        # Updates are arithmetic on Parameters, which must not be recorded
+        with no_grad():
+            for parameter in parameters:
+                self.forward(parameter)
+                parameter.zero_gradient()
 
     @abc.abstractmethod
     def forward(self, parameter):
         pass
 
+    def _state(self, parameter, *names):
+        """Return per-parameter state buffers, allocated on first use.
+
+        State is kept in `self.state` dictionary keyed by parameter's `id`
+        and contains zero-initialized arrays named `names` and `step` counter.
+        Entry is removed once the parameter is garbage collected and is
+        rebuilt if it belongs to another parameter (reused `id`) or does
+        not match parameter's shape or data type.
+
+        """
+        key = id(parameter)
+        state = self.state.get(key)
+        if state is None or not _state_matches(state, parameter, names):
+            state = {name: np.zeros(parameter.shape, parameter.dtype) for name in names}
+            state["step"] = 0
+            state["parameter"] = weakref.ref(
+                parameter, functools.partial(_evict, self.state, key)
+            )
+            self.state[key] = state
+        return state
+
+    def __getstate__(self):
+        # State is keyed by ids of this process' parameters, it is not pickled
+        attributes = self.__dict__.copy()
+        if "state" in attributes:
+            attributes["state"] = {}
+        return attributes
+
+
+def _state_matches(state, parameter, names) -> bool:
+    return state["parameter"]() is parameter and all(
+        state[name].shape == parameter.shape and state[name].dtype == parameter.dtype
+        for name in names
+    )
+
+
+def _evict(states, key, reference) -> None:
+    """Remove state of garbage collected parameter (unless already replaced)."""
+    state = states.get(key)
+    if state is not None and state["parameter"] is reference:
+        del states[key]
+
 
 class SGD(Optimizer):
     """Stochastic Gradient Descent"""
@@ -40,7 +91,8 @@ class SGD(Optimizer):
         self.lr = lr
 
     def forward(self, parameter):
-        parameter -= self.lr * parameter.gradient
+        np.multiply(parameter.gradient, self.lr, out=parameter.gradient)
+        parameter -= parameter.gradient
 
 
 class SGDL2(Optimizer):
@@ -67,3 +119,116 @@ class SGDL1(Optimizer):
     def forward(self, parameter):
         parameter.gradient += self.decay * np.sign(parameter)
         parameter -= self.lr * parameter.gradient
+
+
+class Momentum(Optimizer):
+    """Stochastic Gradient Descent with (optionally Nesterov) momentum"""
+
+    def __init__(self, lr: float = 3e-4, momentum: float = 0.9, nesterov: bool = False):
+        self.lr = lr
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.state = {}
+
+    def forward(self, parameter):
+        gradient = parameter.gradient
+        velocity = self._state(parameter, "velocity")["velocity"]
+        velocity *= self.momentum
+        velocity += gradient
+        if self.nesterov:
+            # parameter -= lr * (gradient + momentum * velocity)
+            gradient *= self.lr
+            parameter -= gradient
+            np.multiply(velocity, self.lr * self.momentum, out=gradient)
+        else:
+            np.multiply(velocity, self.lr, out=gradient)
+        parameter -= gradient
+
+
+class RMSProp(Optimizer):
+    """Root Mean Square Propagation"""
+
+    def __init__(self, lr: float = 3e-4, rho: float = 0.9, eps: float = 1e-8):
+        self.lr = lr
+        self.rho = rho
+        self.eps = eps
+        self.state = {}
+
+    def forward(self, parameter):
+        gradient = parameter.gradient
+        state = self._state(parameter, "square_average", "denominator")
+        square_average, denominator = state["square_average"], state["denominator"]
+        # square_average = rho * square_average + (1 - rho) * gradient ** 2
+        np.square(gradient, out=denominator)
+        square_average -= denominator
+        square_average *= self.rho
+        square_average += denominator
+
+        np.sqrt(square_average, out=denominator)
+        denominator += self.eps
+        gradient /= denominator
+        gradient *= self.lr
+        parameter -= gradient
+
+
+class Adam(Optimizer):
+    """Adaptive Moment Estimation"""
+
+    def __init__(
+        self,
+        lr: float = 3e-4,
+        beta1: float = 0.9,
+        beta2: float = 0.999,
+        eps: float = 1e-8,
+    ):
+        self.lr = lr
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.state = {}
+
+    def forward(self, parameter):
+        gradient = parameter.gradient
+        state = self._state(parameter, "first_moment", "second_moment")
+        first_moment, second_moment = state["first_moment"], state["second_moment"]
+        state["step"] += 1
+
+        # moment = beta * moment + (1 - beta) * value, written as
+        # beta * (moment - value) + value so no temporary is needed
+        first_moment -= gradient
+        first_moment *= self.beta1
+        first_moment += gradient
+        # Gradient is not needed anymore, reuse it's buffer
+        np.square(gradient, out=gradient)
+        second_moment -= gradient
+        second_moment *= self.beta2
+        second_moment += gradient
+
+        # Bias corrections folded into scalars
+        first_correction = 1 - self.beta1 ** state["step"]
+        second_correction = 1 - self.beta2 ** state["step"]
+        np.sqrt(second_moment, out=gradient)
+        gradient /= np.sqrt(second_correction)
+        gradient += self.eps
+        np.divide(first_moment, gradient, out=gradient)
+        gradient *= self.lr / first_correction
+        parameter -= gradient
+
+
+class AdamW(Adam):
+    """Adam with decoupled weight decay"""
+
+    def __init__(
+        self,
+        lr: float = 3e-4,
+        beta1: float = 0.9,
+        beta2: float = 0.999,
+        eps: float = 1e-8,
+        decay: float = 1e-2,
+    ):
+        super().__init__(lr, beta1, beta2, eps)
+        self.decay = decay
+
+    def forward(self, parameter):
+        parameter *= 1 - self.lr * self.decay
+        super().forward(parameter)
@@ -0,0 +1,255 @@
+"""Gradient checking and benchmarking of graph operations and models.
+
+Finite-difference checker can be used for any `Operation`, built-in ones
+are checked by `check_operations`:
+
+    from aicore.ml.graph import testing
+
+    testing.check_gradient(MyOperation, np.random.randn(10, 3))
+    testing.check_operations()
+
+Benchmarks return list of records (one per case and size) which can be
+compared between changes:
+
+    for record in testing.benchmark_operations(sizes=(1_000, 100_000)):
+        print(record)
+
+"""
+
+import time
+
+import numpy as np
+
+from . import models, optimizers
+from ._operations import (
+    _Add,
+    _BCEWithLogits,
+    _CrossEntropyWithLogits,
+    _Divide,
+    _Dot,
+    _Exp,
+    _Log,
+    _Mean,
+    _Multiply,
+    _Negative,
+    _Sqrt,
+    _Square,
+    _SquaredError,
+    _Subtract,
+    _Sum,
+    _Tanh,
+)
+from ._parameter import _reduce_to_shape
+
+###############################################################################
+#
+#                               CASES
+#
+###############################################################################
+
+
+def operation_cases(size: int, n_features: int = 16, n_classes: int = 10, seed=0):
+    """Return built-in operations with example inputs of `size` rows.
+
+    Returns:
+        Dict[str, Tuple[Callable[[], Operation], Tuple[np.array]]]:
+            Name of case mapped to factory creating operation and
+            it's inputs.
+
+    """
+    random = np.random.default_rng(seed)
+    X = random.standard_normal((size, n_features))
+    logits = random.standard_normal((size, n_classes))
+    vector = random.standard_normal(size)
+    bias = random.standard_normal(n_classes)
+    positive = random.uniform(0.5, 2.0, size=(size, n_classes))
+    return {
+        "add": (_Add, (logits, bias)),
+        "subtract": (_Subtract, (logits, bias)),
+        "multiply": (_Multiply, (logits, bias)),
+        "divide": (_Divide, (logits, positive)),
+        "negative": (_Negative, (logits,)),
+        "exp": (_Exp, (logits,)),
+        "log": (_Log, (positive,)),
+        "square": (_Square, (logits,)),
+        "sqrt": (_Sqrt, (positive,)),
+        "tanh": (_Tanh, (logits,)),
+        "sum(axis=0)": (lambda: _Sum(axis=0), (logits,)),
+        "mean": (_Mean, (vector,)),
+        "mean(axis=0)": (lambda: _Mean(axis=0), (logits,)),
+        "dot(vector)": (_Dot, (X, random.standard_normal(n_features))),
+        "dot(matrix)": (_Dot, (X, random.standard_normal((n_features, n_classes)))),
+        "squared_error": (_SquaredError, (vector, random.standard_normal(size))),
+        "bce_with_logits": (_BCEWithLogits, (vector, random.uniform(size=size))),
+        "ce_with_logits": (
+            _CrossEntropyWithLogits,
+            (logits, random.integers(n_classes, size=size)),
+        ),
+    }
+
+
+###############################################################################
+#
+#                           GRADIENT CHECKING
+#
+###############################################################################
+
+
+def check_gradient(
+    operation,
+    *inputs,
+    eps: float = 1e-6,
+    rtol: float = 1e-5,
+    atol: float = 1e-8,
+    n_directions: int = 3,
+    seed=0,
+) -> None:
+    """Compare gradients of operation with central finite differences.
+
+    Operation's output is reduced to scalar `sum(output * upstream)` with
+    random `upstream` which is passed to `backward`. Instead of perturbing
+    each element separately, the whole input is moved along random
+    directions, so the check costs two forward passes per direction
+    regardless of input's size.
+
+    Integer inputs (e.g. labels) and inputs for which `backward` returns
+    `None` are skipped.
+
+    Arguments:
+        operation:
+            Callable returning new instance of `Operation` (e.g. the class).
+        inputs:
+            Inputs to operation's forward.
+
+    Raises:
+        AssertionError: if analytical and numerical gradients differ.
+
+    """
+    random = np.random.default_rng(seed)
+    inputs = [np.asarray(value) for value in inputs]
+    upstream = random.standard_normal(np.shape(operation().forward(*inputs)))
+
+    def objective(values):
+        return np.sum(operation().forward(*values) * upstream)
+
+    instance = operation()
+    instance.forward(*inputs)
+    gradients = instance.backward(upstream)
+    if not isinstance(gradients, (tuple, list)):
+        gradients = (gradients,)
+
+    for index, (value, gradient) in enumerate(zip(inputs, gradients)):
+        if gradient is None or value.dtype.kind != "f":
+            continue
+        gradient = _reduce_to_shape(np.asarray(gradient), value.shape)
+        for _ in range(n_directions):
+            direction = random.standard_normal(value.shape)
+            shifted = list(inputs)
+            shifted[index] = value + eps * direction
+            positive = objective(shifted)
+            shifted[index] = value - eps * direction
+            negative = objective(shifted)
+            numerical = (positive - negative) / (2 * eps)
+            analytical = np.sum(gradient * direction)
+            if not np.isclose(analytical, numerical, rtol=rtol, atol=atol):
+                raise AssertionError(
+                    f"Gradient of input {index} of {type(instance).__name__} "
+                    f"differs: analytical {analytical}, numerical {numerical}"
+                )
+
+
+def check_operations(size: int = 7) -> None:
+    """Run `check_gradient` for every built-in operation."""
+    for name, (operation, inputs) in operation_cases(size).items():
+        try:
+            check_gradient(operation, *inputs)
+        except AssertionError as error:
+            raise AssertionError(f"{name}: {error}") from error
+
+
+###############################################################################
+#
+#                               BENCHMARKS
+#
+###############################################################################
+
+
+def _best_time(function, repeat: int, setup=None) -> float:
+    best = np.inf
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_operations(sizes=(1_000, 10_000, 100_000), repeat: int = 5):
+    """Time forward and backward of every built-in operation.
+
+    Returns:
+        List[Dict]: Records with `name`, `size` and best `forward`
+        and `backward` time in seconds.
+
+    """
+    records = []
+    for size in sizes:
+        for name, (operation, inputs) in operation_cases(size).items():
+            instance = operation()
+            upstream = np.ones(np.shape(instance.forward(*inputs)))
+            records.append(
+                {
+                    "name": name,
+                    "size": size,
+                    "forward": _best_time(lambda: instance.forward(*inputs), repeat),
+                    # Backward may reuse cache in place, hence fresh forward
+                    "backward": _best_time(
+                        lambda: instance.backward(upstream),
+                        repeat,
+                        setup=lambda: instance.forward(*inputs),
+                    ),
+                }
+            )
+    return records
+
+
+def benchmark_models(
+    sizes=(1_000, 10_000, 100_000),
+    n_features: int = 16,
+    n_classes: int = 10,
+    epochs: int = 5,
+    repeat: int = 3,
+):
+    """Time `fit` (per epoch) of every graph model.
+
+    Returns:
+        List[Dict]: Records with `name`, `size` and best `fit` time
+        per epoch in seconds.
+
+    """
+    random = np.random.default_rng(0)
+    records = []
+    for size in sizes:
+        X = random.standard_normal((size, n_features))
+        cases = {
+            "LinearRegression": (
+                lambda: models.LinearRegression(n_features, optimizers.SGD()),
+                random.standard_normal(size),
+            ),
+            "BinaryLogisticRegression": (
+                lambda: models.BinaryLogisticRegression(n_features, optimizers.SGD()),
+                random.integers(2, size=size).astype(float),
+            ),
+            "MulticlassLogisticRegression": (
+                lambda: models.MulticlassLogisticRegression(
+                    n_classes, n_features, optimizers.SGD()
+                ),
+                random.integers(n_classes, size=size),
+            ),
+        }
+        for name, (model, y) in cases.items():
+            instance = model()
+            fit_time = _best_time(lambda: instance.fit(X, y, epochs=epochs), repeat)
+            records.append({"name": name, "size": size, "fit": fit_time / epochs})
+    return records
@@ -50,17 +50,38 @@ def show(X, Y, predictions=None):
     plt.show()
 
 
-def visualise_predictions(H, X, Y=None, n=50):
-    xmin, xmax, ymin, ymax = min(X[:, 0]), max(X[:, 0]), min(X[:, 1]), max(X[:, 1])
-    meshgrid = np.zeros((n, n))
-    for x1_idx, x1 in enumerate(np.linspace(xmin, xmax, n)):  # for each column
-        for x2_idx, x2 in enumerate(np.linspace(ymin, ymax, n)):  # for each row
-            h = H(np.array([[x1, x2]]))[0]
-            meshgrid[
-                n - 1 - x2_idx, x1_idx
-            ] = h  # axis 0 is the vertical direction starting from the top and increasing downward
+def _predict_grid(H, xmin, xmax, ymin, ymax, n, batch_size):
+    """Return `n x n` predictions of `H` over grid, first row is the top (ymax)."""
+    # axis 0 is the vertical direction starting from the top and increasing downward
+    x1, x2 = np.meshgrid(np.linspace(xmin, xmax, n), np.linspace(ymin, ymax, n)[::-1])
+    grid = np.column_stack((x1.ravel(), x2.ravel()))
+    predictions = [
+        # First output of every sample, just like `H(sample)[0]`
+        np.asarray(H(batch)).reshape(len(batch), -1)[:, 0]
+        for batch in np.array_split(grid, max(1, -(-len(grid) // batch_size)))
+    ]
+    return np.concatenate(predictions).reshape(n, n)
+
+
+def visualise_predictions(
+    H, X, Y=None, n=50, batch_size: int = 65536, max_points: int = None, seed=None
+):
+    """Plot predictions of `H` over `n x n` grid spanning `X` with data on top.
+
+    `H` is called on batches of at most `batch_size` grid points. If
+    `max_points` is provided, at most that many (random) samples of `X`
+    are scattered.
+
+    """
+    xmin, xmax = np.min(X[:, 0]), np.max(X[:, 0])
+    ymin, ymax = np.min(X[:, 1]), np.max(X[:, 1])
+    meshgrid = _predict_grid(H, xmin, xmax, ymin, ymax, n, batch_size)
+    if max_points is not None and len(X) > max_points:
+        shown = np.random.default_rng(seed).choice(len(X), max_points, replace=False)
+        X = X[shown]
+        Y = None if Y is None else np.asarray(Y)[shown]
     if Y is not None:
-        for idx in list(set(Y)):
+        for idx in np.unique(Y):
             plt.scatter(X[Y == idx][:, 0], X[Y == idx][:, 1], c=_COLORS[idx])
     else:
         plt.scatter(X[:, 0], X[:, 1])
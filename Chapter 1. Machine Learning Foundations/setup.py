@@ -21,8 +21,9 @@ setuptools.setup(
     long_description=open("README.md", "r").read(),
     long_description_content_type="text/markdown",
     url="https://www.theaicore.com/",
-    packages=setuptools.find_packages(),
-    install_requires=["numpy>=1.19.4", "scikit-learn>=0.23.2"],
+    packages=setuptools.find_packages(exclude=("tests", "tests.*")),
+    install_requires=["numpy>=1.19.4", "scipy>=1.5.4", "scikit-learn>=0.23.2"],
+    extras_require={"test": ["pytest", "pytest-benchmark"]},
     python_requires=">=3.6",
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
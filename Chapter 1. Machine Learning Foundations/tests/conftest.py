@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from aicore.ml import graph as g
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--time-budgets",
+        action="store_true",
+        help="Fail benchmarks exceeding absolute time budgets (noisy on shared "
+        "machines, prefer --benchmark-compare-fail).",
+    )
+
+
+@pytest.fixture(autouse=True)
+def clean_graph():
+    """Every test starts with empty tape and seeded global random state."""
+    g.get().clear()
+    np.random.seed(0)
+    yield
+    g.get().clear()
+    g.set_default_dtype()
+
+
+@pytest.fixture
+def random():
+    return np.random.default_rng(0)
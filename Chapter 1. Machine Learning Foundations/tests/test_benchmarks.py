@@ -0,0 +1,138 @@
+"""Performance regression tests, run with `pytest-benchmark`.
+
+Regressions relative to a previous run are caught by comparing against
+saved results:
+
+    pytest tests --benchmark-autosave
+    pytest tests --benchmark-compare --benchmark-compare-fail=mean:10%
+
+Absolute time budgets below are generous and only catch pathological
+slowdowns (e.g. accidental quadratic work or copies of whole datasets).
+Wall-clock time is noisy on shared machines, hence those are checked only
+with `--time-budgets`. Run `pytest --benchmark-skip` to skip benchmarks
+altogether.
+
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from aicore.ml import graph as g
+from aicore.ml.graph import models, optimizers, testing
+
+pytest.importorskip("pytest_benchmark")
+
+SIZE = 10_000
+# Upper bound of mean time per sample (row) in seconds
+OPERATION_BUDGET = 1e-6
+FIT_BUDGET = 2e-5
+
+CASES = testing.operation_cases(size=SIZE)
+
+
+@pytest.fixture
+def check_budget(request):
+    """Return function asserting mean time of benchmark is within budget."""
+
+    def check(benchmark, budget):
+        if request.config.getoption("--time-budgets"):
+            assert benchmark.stats.stats.mean < budget
+
+    return check
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_operation_forward(benchmark, check_budget, name):
+    operation, inputs = CASES[name]
+    instance = operation()
+    benchmark.group = "forward"
+    benchmark(instance.forward, *inputs)
+    check_budget(benchmark, OPERATION_BUDGET * SIZE)
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_operation_backward(benchmark, check_budget, name):
+    operation, inputs = CASES[name]
+    instance = operation()
+    upstream = np.ones(np.shape(instance.forward(*inputs)))
+
+    def setup():
+        # Backward may reuse cache in place, hence fresh forward
+        instance.forward(*inputs)
+        return (upstream,), {}
+
+    benchmark.group = "backward"
+    benchmark.pedantic(instance.backward, setup=setup, rounds=20)
+    check_budget(benchmark, OPERATION_BUDGET * SIZE)
+
+
+def _model_cases(random, n_features=16, n_classes=10):
+    X = random.standard_normal((SIZE, n_features))
+    return {
+        "LinearRegression": (
+            models.LinearRegression(n_features, optimizers.SGD()),
+            X,
+            random.standard_normal(SIZE),
+        ),
+        "BinaryLogisticRegression": (
+            models.BinaryLogisticRegression(n_features, optimizers.SGD()),
+            X,
+            random.integers(2, size=SIZE).astype(float),
+        ),
+        "MulticlassLogisticRegression": (
+            models.MulticlassLogisticRegression(
+                n_classes, n_features, optimizers.SGD()
+            ),
+            X,
+            random.integers(n_classes, size=SIZE),
+        ),
+    }
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["LinearRegression", "BinaryLogisticRegression", "MulticlassLogisticRegression"],
+)
+@pytest.mark.parametrize("batch_size", [None, 256])
+def test_model_fit(benchmark, check_budget, random, name, batch_size):
+    model, X, y = _model_cases(random)[name]
+    benchmark.group = f"fit (batch_size={batch_size})"
+    benchmark.pedantic(
+        model.fit, args=(X, y), kwargs={"epochs": 1, "batch_size": batch_size}, rounds=5
+    )
+    check_budget(benchmark, FIT_BUDGET * SIZE)
+    assert not g.get().operations
+
+
+def _check_records(records, names, sizes, keys):
+    assert {(record["name"], record["size"]) for record in records} == {
+        (name, size) for name in names for size in sizes
+    }
+    for record in records:
+        for key in keys:
+            assert record[key] > 0 and math.isfinite(record[key])
+
+
+def test_benchmark_operations(benchmark):
+    sizes = (100, 1_000)
+    records = benchmark.pedantic(
+        testing.benchmark_operations, kwargs={"sizes": sizes, "repeat": 2}, rounds=1
+    )
+    _check_records(records, CASES, sizes, ("forward", "backward"))
+
+
+def test_benchmark_models(benchmark):
+    sizes = (100, 1_000)
+    records = benchmark.pedantic(
+        testing.benchmark_models,
+        kwargs={"sizes": sizes, "epochs": 1, "repeat": 1},
+        rounds=1,
+    )
+    names = [
+        "LinearRegression",
+        "BinaryLogisticRegression",
+        "MulticlassLogisticRegression",
+    ]
+    _check_records(records, names, sizes, ("fit",))
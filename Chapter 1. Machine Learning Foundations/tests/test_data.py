@@ -0,0 +1,217 @@
+import threading
+
+import numpy as np
+import pytest
+
+from aicore.ml import data
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+@pytest.mark.parametrize("prefetch", [0, 2])
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_data_loader_batches(shuffle, prefetch, drop_last):
+    X = np.arange(23 * 2).reshape(23, 2)
+    y = np.arange(23)
+    loader = data.DataLoader(
+        X, y, batch_size=5, shuffle=shuffle, drop_last=drop_last, prefetch=prefetch
+    )
+    batches = list(loader)
+    assert len(batches) == len(loader) == (4 if drop_last else 5)
+    seen = np.concatenate([y_batch for _, y_batch in batches])
+    assert len(np.unique(seen)) == len(seen) == (20 if drop_last else 23)
+    for X_batch, y_batch in batches:
+        np.testing.assert_array_equal(X_batch, X[y_batch])
+    if not shuffle:
+        assert all(np.shares_memory(X_batch, X) for X_batch, _ in batches)
+
+
+def test_data_loader_reshuffles_every_epoch():
+    loader = data.DataLoader(np.arange(100), batch_size=10)
+    (first,), (second,) = next(iter(loader)), next(iter(loader))
+    # Rows of a batch are gathered in storage order, only membership changes
+    np.testing.assert_array_equal(first, np.sort(first))
+    assert not np.array_equal(first, second)
+
+
+def _prefetch_threads():
+    return [
+        thread
+        for thread in threading.enumerate()
+        if thread is not threading.main_thread() and thread.daemon
+    ]
+
+
+def test_prefetch_stops_thread_on_early_break():
+    before = len(_prefetch_threads())
+    loader = data.DataLoader(np.arange(1000), batch_size=1, prefetch=2)
+    iterator = iter(loader)
+    for index, _ in enumerate(iterator):
+        if index == 3:
+            break
+    iterator.close()
+    assert len(_prefetch_threads()) == before
+
+
+def test_prefetch_propagates_errors():
+    def broken():
+        yield 1
+        raise RuntimeError("broken batch")
+
+    iterator = data._prefetch(broken(), 2)
+    assert next(iterator) == 1
+    with pytest.raises(RuntimeError, match="broken batch"):
+        next(iterator)
+
+
+def _check_partition(partitions, n_samples):
+    indices = np.concatenate(partitions)
+    np.testing.assert_array_equal(np.sort(indices), np.arange(n_samples))
+    for partition in partitions:
+        np.testing.assert_array_equal(partition, np.sort(partition))
+
+
+def test_split_indices_covers_all_samples():
+    partitions = data.split_indices(101, (0.6, 0.2, 0.2), seed=0)
+    _check_partition(partitions, 101)
+    assert [len(partition) for partition in partitions] == [61, 20, 20]
+
+
+def test_split_indices_is_deterministic():
+    first = data.split_indices(50, seed=3)
+    second = data.split_indices(50, seed=3)
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_split_indices_stratify(random):
+    labels = random.choice(3, size=1000, p=[0.7, 0.2, 0.1])
+    partitions = data.split_indices(1000, (0.5, 0.3, 0.2), stratify=labels, seed=0)
+    _check_partition(partitions, 1000)
+    expected = np.bincount(labels) / 1000
+    for partition in partitions:
+        proportions = np.bincount(labels[partition], minlength=3) / len(partition)
+        np.testing.assert_allclose(proportions, expected, atol=0.01)
+
+
+def test_split_indices_groups(random):
+    groups = random.integers(40, size=500)
+    partitions = data.split_indices(500, (0.6, 0.2, 0.2), groups=groups, seed=0)
+    _check_partition(partitions, 500)
+    members = [set(groups[partition]) for partition in partitions]
+    for i, first in enumerate(members):
+        for second in members[i + 1 :]:
+            assert not first & second
+
+
+def test_split_indices_rejects_invalid_arguments():
+    with pytest.raises(ValueError):
+        data.split_indices(10, (0.5, 0.2))
+    with pytest.raises(ValueError):
+        data.split_indices(10, stratify=np.zeros(10), groups=np.zeros(10))
+
+
+def test_running_standardizer_merge(random):
+    X = random.standard_normal((1000, 4)) * 3 + 5
+    first = data.RunningStandardizer().fit(X[:300], chunk_size=64)
+    second = data.RunningStandardizer().fit(X[300:], chunk_size=100)
+    merged = first.merge(second)
+    np.testing.assert_allclose(merged.mean, X.mean(axis=0))
+    np.testing.assert_allclose(merged.std, X.std(axis=0))
+    np.testing.assert_allclose(
+        merged.transform(X), (X - X.mean(axis=0)) / X.std(axis=0), atol=1e-12
+    )
+
+
+@pytest.fixture
+def csv(tmp_path, random):
+    values = np.round(random.standard_normal((37, 4)), 6)
+    path = tmp_path / "data.csv"
+    lines = ["a,b,c,target"] + [",".join(map(str, row)) for row in values]
+    # Blank lines (e.g. trailing newline) are skipped
+    path.write_text("\n".join(lines) + "\n\n")
+    return path, values
+
+
+def test_csv_to_npy(csv, tmp_path):
+    path, values = csv
+    dataset = data.csv_to_npy(path, tmp_path / "X.npy", skiprows=1, chunk_size=5)
+    assert isinstance(dataset, data.NpyDataset)
+    assert dataset.shape == values.shape and len(dataset) == len(values)
+    np.testing.assert_allclose(np.asarray(dataset), values)
+    np.testing.assert_allclose(np.load(tmp_path / "X.npy"), values)
+
+
+def test_csv_to_npy_columns(csv, tmp_path):
+    path, values = csv
+    X = data.csv_to_npy(path, tmp_path / "X.npy", skiprows=1, usecols=(0, 1, 2))
+    y = data.csv_to_npy(
+        path, tmp_path / "y.npy", skiprows=1, usecols=3, dtype=np.float32
+    )
+    np.testing.assert_allclose(np.asarray(X), values[:, :3])
+    assert y.shape == (37,) and y.dtype == np.float32
+    np.testing.assert_allclose(np.asarray(y), values[:, 3], rtol=1e-6)
+
+
+@pytest.fixture
+def npy(tmp_path, random):
+    values = random.standard_normal((50, 3))
+    np.save(tmp_path / "X.npy", values)
+    return data.NpyDataset(tmp_path / "X.npy"), values
+
+
+def test_npy_dataset_is_memory_mapped(npy):
+    dataset, values = npy
+    assert isinstance(dataset.data, np.memmap)
+    assert not dataset.data.flags.writeable
+    batch = dataset[[1, 5, 7]]
+    assert type(batch) is np.ndarray
+    np.testing.assert_array_equal(batch, values[[1, 5, 7]])
+    chunks = list(dataset.chunks(chunk_size=16))
+    assert [len(chunk) for chunk in chunks] == [16, 16, 16, 2]
+    np.testing.assert_array_equal(np.concatenate(chunks), values)
+
+
+def test_npy_dataset_transform(npy):
+    dataset, values = npy
+    doubled = dataset.map(lambda batch: batch * 2)
+    shifted = doubled.map(lambda batch: batch + 1)
+    assert dataset.transform is None
+    np.testing.assert_array_equal(doubled[:4], values[:4] * 2)
+    np.testing.assert_array_equal(np.asarray(shifted), values * 2 + 1)
+
+
+def test_npy_dataset_with_data_loader(npy):
+    dataset, values = npy
+    standardizer = data.RunningStandardizer().fit(dataset, chunk_size=7)
+    standardized = dataset.map(standardizer.transform)
+    batches = list(data.DataLoader(standardized, batch_size=8, drop_last=False))
+    assert sum(len(batch) for batch, in batches) == 50
+    rows = np.sort(np.concatenate([batch for batch, in batches]), axis=0)
+    expected = (values - values.mean(axis=0)) / values.std(axis=0)
+    np.testing.assert_allclose(rows, np.sort(expected, axis=0))
+
+
+def test_save_partitions_npy(npy, tmp_path):
+    dataset, values = npy
+    partitions = data.split_indices(len(dataset), (0.6, 0.2, 0.2), seed=0)
+    paths = [tmp_path / f"{name}.npy" for name in ("train", "valid", "test")]
+    data.save_partitions(dataset, partitions, paths, chunk_size=4)
+    for partition, path in zip(partitions, paths):
+        saved = data.NpyDataset(path)
+        assert saved.dtype == values.dtype
+        np.testing.assert_array_equal(np.asarray(saved), values[partition])
+
+
+def test_save_partitions_parquet(npy, tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    dataset, values = npy
+    partitions = data.split_indices(len(dataset), (0.5, 0.5), seed=0)
+    paths = [tmp_path / "train.parquet", tmp_path / "test.parquet"]
+    data.save_partitions(dataset, partitions, paths, chunk_size=4)
+    for partition, path in zip(partitions, paths):
+        table = parquet.read_table(path)
+        assert table.column_names == ["0", "1", "2"]
+        np.testing.assert_array_equal(
+            np.column_stack([column.to_numpy() for column in table.columns]),
+            values[partition],
+        )
@@ -0,0 +1,165 @@
+import gc
+import threading
+
+import numpy as np
+import pytest
+
+from aicore.ml import graph as g
+from aicore.ml.graph import models, optimizers
+
+
+def _record(random):
+    W = g.Parameter(random.standard_normal(3))
+    g.mean(random.standard_normal((4, 3)) @ W)
+    return W
+
+
+def test_no_grad_nested_restores_state(random):
+    with g.no_grad():
+        with g.no_grad():
+            _record(random)
+        _record(random)
+        assert not g.get().operations
+    _record(random)
+    assert g.get().operations
+
+
+def test_no_grad_restores_state_on_error(random):
+    with pytest.raises(RuntimeError):
+        with g.no_grad():
+            raise RuntimeError
+    _record(random)
+    assert g.get().operations
+
+
+def test_no_grad_is_thread_local(random):
+    started, stop = threading.Event(), threading.Event()
+
+    def idle():
+        with g.no_grad():
+            started.set()
+            stop.wait()
+
+    thread = threading.Thread(target=idle)
+    thread.start()
+    started.wait()
+    try:
+        _record(random)
+        assert g.get().operations
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_graph_is_thread_local(random):
+    W = _record(random)
+    other = {}
+
+    def train():
+        other["graph"] = g.get()
+        other["operations"] = len(g.get().operations)
+
+    thread = threading.Thread(target=train)
+    thread.start()
+    thread.join()
+    assert other["graph"] is not g.get()
+    assert other["operations"] == 0
+    g.get().backward()
+    assert W.gradient is not None
+
+
+def test_backward_requires_recording(random):
+    _record(random)
+    with g.no_grad(), pytest.raises(ValueError):
+        g.get().backward()
+
+
+def test_scope_isolates_graph(random):
+    outer = g.get()
+    registered = set(outer.parameters)
+    with g.scope() as graph:
+        assert g.get() is graph is not outer
+        model = models.LinearRegression(3, optimizers.SGD(0.1))
+        X = random.standard_normal((10, 3))
+        model.fit(X, X @ np.ones(3), epochs=2)
+        assert len(graph.parameters) == 2
+        graph_X = X @ model.W
+    assert g.get() is outer
+    assert not graph.operations
+    assert set(outer.parameters) == registered and not outer.operations
+    # Recorded in dropped graph, constant for the outer one
+    assert type(graph_X * 2) is np.ndarray
+
+
+def test_parameters_are_registered_weakly():
+    graph = g.get()
+    W = g.Parameter(np.ones(3))
+    index = W.index_in_graph
+    assert graph.parameters[index] is W
+    del W
+    gc.collect()
+    assert index not in graph.parameters
+
+
+def test_release_removes_parameters():
+    graph = g.get()
+    W, b = g.Parameter(np.ones(3)), g.Parameter(np.ones(1))
+    graph.release(W)
+    assert W.index_in_graph not in graph.parameters
+    assert graph.parameters[b.index_in_graph] is b
+    # Releasing twice is a no-op
+    graph.release(W)
+
+
+@pytest.fixture
+def precision():
+    def set_precision(dtype=None, compute_dtype=None):
+        g.set_default_dtype(dtype, compute_dtype)
+
+    yield set_precision
+    g.set_default_dtype()
+
+
+def test_default_dtype_of_parameters(precision):
+    assert g.Parameter(np.ones(3)).dtype == np.float64
+    precision(np.float32)
+    assert g.get_default_dtype() == np.float32
+    assert g.Parameter(np.ones(3)).dtype == np.float32
+    # Integer parameters keep their type
+    assert g.Parameter(np.arange(3)).dtype == np.arange(3).dtype
+    assert g.Parameter(np.ones(3), dtype=np.float64).dtype == np.float64
+
+
+def test_float32_training(random, precision):
+    precision(np.float32)
+    X = random.standard_normal((64, 4))
+    model = models.MulticlassLogisticRegression(3, 4, optimizers.Adam(0.1))
+    history = model.fit(X, random.integers(3, size=64), epochs=3)
+    for parameter in model.parameters():
+        assert parameter.dtype == np.float32
+        assert parameter.gradient.dtype == np.float32
+    for state in model.optimizer.state.values():
+        assert state["first_moment"].dtype == np.float32
+    assert np.all(np.isfinite(history["loss"]))
+
+
+def test_mixed_precision(random, precision):
+    precision(np.float64, compute_dtype=np.float32)
+    X = random.standard_normal((8, 3))
+    W = g.Parameter(random.standard_normal(3))
+    output = g.mean(g.tanh(X @ W))
+    assert output.dtype == np.float32
+    g.get().backward()
+    # Master weights and their gradients stay in float64
+    assert W.dtype == W.gradient.dtype == np.float64
+    expected = X.T @ (1 - np.tanh(X @ np.asarray(W)) ** 2) / 8
+    np.testing.assert_allclose(W.gradient, expected, rtol=1e-5)
+
+
+def test_compute_dtype_does_not_cast_integers(random, precision):
+    precision(compute_dtype=np.float32)
+    logits = g.Parameter(random.standard_normal((5, 3)))
+    labels = np.array([0, 2, 1, 1, 0])
+    g.mean(g.ce_with_logits(logits, labels))
+    g.get().backward()
+    assert logits.gradient.dtype == np.float64
@@ -0,0 +1,210 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from aicore.ml import graph as g
+from aicore.ml.graph import models, optimizers
+
+from .test_operations import _check
+
+
+def _problems(random, n_samples=12, n_features=4, n_classes=3):
+    X = random.standard_normal((n_samples, n_features))
+    return {
+        "linear": (
+            models.LinearRegression(n_features, optimizers.SGD(0.1)),
+            X,
+            random.standard_normal(n_samples),
+        ),
+        "binary": (
+            models.BinaryLogisticRegression(n_features, optimizers.SGD(0.1)),
+            X,
+            random.integers(2, size=n_samples).astype(float),
+        ),
+        "multiclass": (
+            models.MulticlassLogisticRegression(
+                n_classes, n_features, optimizers.SGD(0.1)
+            ),
+            X,
+            random.integers(n_classes, size=n_samples),
+        ),
+    }
+
+
+@pytest.mark.parametrize("name", ["linear", "binary", "multiclass"])
+@pytest.mark.parametrize("sparse_input", [False, True])
+def test_model_gradient(random, name, sparse_input):
+    model, X, y = _problems(random)[name]
+    if sparse_input:
+        X = sparse.csr_matrix(X)
+    _check(lambda: model._loss(X, y), *model.parameters())
+
+
+@pytest.mark.parametrize("name", ["linear", "binary", "multiclass"])
+def test_fit_decreases_loss(random, name):
+    model, X, y = _problems(random, n_samples=200)[name]
+    history = model.fit(X, y, epochs=20, batch_size=32)
+    assert history["loss"][-1] < history["loss"][0]
+
+
+def test_fit_trains_on_remainder_batch(random):
+    model, X, y = _problems(random, n_samples=10)["linear"]
+    history = model.fit(X, y, epochs=2, batch_size=64)
+    assert len(history["loss"]) == 2
+
+
+def test_fit_rejects_empty_data(random):
+    model, X, y = _problems(random)["linear"]
+    with pytest.raises(ValueError):
+        model.fit(X[:0], y[:0], epochs=1, batch_size=4)
+
+
+@pytest.mark.parametrize(
+    "name, method",
+    [
+        ("linear", "predict"),
+        ("binary", "predict_logits"),
+        ("binary", "predict_proba"),
+        ("binary", "predict"),
+        ("multiclass", "predict_logits"),
+        ("multiclass", "predict_proba"),
+        ("multiclass", "predict"),
+    ],
+)
+def test_predictions_are_not_recorded(random, name, method):
+    model, X, _ = _problems(random)[name]
+    assert type(getattr(model, method)(X)) is np.ndarray
+    assert not g.get().operations
+
+
+def test_arena_training_matches_separate_parameters(random):
+    first, X, y = _problems(random)["multiclass"]
+    second = models.MulticlassLogisticRegression(3, 4, optimizers.Adam(0.1))
+    first.optimizer = optimizers.Adam(0.1)
+    for parameter, value in zip(second.parameters(), first.parameters()):
+        np.copyto(parameter, value)
+    second.use_arena()
+    first.fit(X, y, epochs=5)
+    second.fit(X, y, epochs=5)
+    for a, b in zip(first.parameters(), second.parameters()):
+        np.testing.assert_allclose(a, b)
+
+
+def test_arena_clear_keeps_shared_buffer(random):
+    model, X, y = _problems(random)["linear"]
+    arena = model.use_arena()
+    buffer = model.W.gradient
+    model.W.clear()
+    assert model.W.gradient is buffer
+    with pytest.raises(ValueError):
+        model.W.gradient = None
+    model.fit(X, y, epochs=1)
+    assert np.shares_memory(model.W.gradient, arena.data.gradient)
+
+
+@pytest.mark.parametrize("solver", ["cholesky", "qr", "streaming"])
+def test_least_squares_solvers(random, solver):
+    X = random.standard_normal((300, 5))
+    y = X @ random.standard_normal(5) + 2 + 0.1 * random.standard_normal(300)
+    model = models.LinearRegression(5)
+    history = model.fit(X, y, solver=solver, batch_size=64)
+    coefficients, *_ = np.linalg.lstsq(
+        np.column_stack([X, np.ones(300)]), y, rcond=None
+    )
+    np.testing.assert_allclose(model.W, coefficients[:-1])
+    np.testing.assert_allclose(model.b, coefficients[-1:])
+    assert history["loss"][0] == pytest.approx(model.loss(X, y))
+
+
+def test_exact_fit_loss_is_not_negative(random):
+    X = random.standard_normal((50, 3))
+    history = models.LinearRegression(3).fit(
+        X, X @ np.arange(3.0) + 1, solver="streaming"
+    )
+    assert history["loss"][0] >= 0
+
+
+def test_lbfgs_decreases_loss(random):
+    model, X, y = _problems(random, n_samples=200)["binary"]
+    history = model.fit(X, y, solver="lbfgs", epochs=50)
+    assert history["loss"][-1] < history["loss"][0]
+
+
+def test_lbfgs_history_has_loss_per_iteration(random):
+    model, X, y = _problems(random, n_samples=200)["binary"]
+    history = model.fit(X, y, solver="lbfgs", epochs=3)
+    assert len(history["loss"]) == 3
+    assert history["loss"][-1] == pytest.approx(model.loss(X, y))
+
+
+@pytest.mark.parametrize("solver", ["cholesky", "qr", "streaming", "lbfgs"])
+def test_solvers_reject_empty_data(random, solver):
+    X = random.standard_normal((0, 3))
+    with pytest.raises(ValueError, match="No samples"):
+        models.LinearRegression(3).fit(X, X[:, 0], solver=solver, batch_size=8)
+
+
+def test_multiclass_predict_returns_labels(random):
+    model, X, y = _problems(random)["multiclass"]
+    labels = model.predict(X)
+    assert labels.shape == y.shape
+    assert np.issubdtype(labels.dtype, np.integer)
+    np.testing.assert_array_equal(labels, np.argmax(model.predict_proba(X), axis=1))
+    np.testing.assert_array_equal(labels, model.compile().predict(X))
+
+
+@pytest.mark.parametrize("name", ["linear", "binary", "multiclass"])
+@pytest.mark.parametrize("sparse_input", [False, True])
+def test_compiled_predictor_matches_model(random, name, sparse_input):
+    model, X, _ = _problems(random)[name]
+    predictor = model.compile()
+    if sparse_input:
+        X = sparse.csr_matrix(X)
+    for method in ("predict", "predict_logits", "predict_proba"):
+        if hasattr(model, method):
+            np.testing.assert_allclose(
+                getattr(predictor, method)(X), getattr(model, method)(X)
+            )
+
+
+def test_compiled_predictor_is_frozen(random):
+    model, X, y = _problems(random)["binary"]
+    predictor = model.compile(dtype=np.float32)
+    expected = predictor.predict_proba(X)
+    model.fit(X, y, epochs=3)
+    assert predictor.W.dtype == np.float32
+    assert not predictor.W.flags.writeable
+    np.testing.assert_array_equal(predictor.predict_proba(X), expected)
+
+
+def _fit_pair(random, arena, n_jobs, batch_size=None):
+    X = random.standard_normal((203, 5))
+    y = random.integers(3, size=203)
+    fitted = []
+    for jobs in (None, n_jobs):
+        np.random.seed(0)
+        model = models.MulticlassLogisticRegression(3, 5, optimizers.Adam(0.05))
+        if arena:
+            model.use_arena()
+        history = model.fit(X, y, epochs=4, batch_size=batch_size, n_jobs=jobs)
+        fitted.append((model, history))
+    return fitted
+
+
+@pytest.mark.parametrize("arena", [False, True])
+def test_data_parallel_fit_matches_serial(random, arena):
+    (serial, serial_history), (parallel, parallel_history) = _fit_pair(
+        random, arena, n_jobs=2
+    )
+    for a, b in zip(serial.parameters(), parallel.parameters()):
+        np.testing.assert_allclose(a, b, rtol=1e-6)
+    np.testing.assert_allclose(serial_history["loss"], parallel_history["loss"])
+    if arena:
+        assert np.shares_memory(parallel.W, parallel.arena.data)
+
+
+def test_data_parallel_fit_trains_on_remainder(random):
+    X = random.standard_normal((50, 3))
+    model = models.LinearRegression(3, optimizers.SGD(0.1))
+    history = model.fit(X, X @ np.arange(3.0), epochs=2, batch_size=64, n_jobs=2)
+    assert len(history["loss"]) == 2
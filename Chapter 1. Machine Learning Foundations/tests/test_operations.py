@@ -0,0 +1,241 @@
+import warnings
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from aicore.ml import graph as g
+from aicore.ml.graph import testing
+
+CASES = testing.operation_cases(size=7)
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_operation_gradient(name):
+    operation, inputs = CASES[name]
+    testing.check_gradient(operation, *inputs)
+
+
+def _numerical_gradient(loss, parameter, eps=1e-6):
+    gradient = np.zeros(parameter.shape)
+    with g.no_grad():
+        for index in np.ndindex(parameter.shape):
+            original = parameter[index]
+            parameter[index] = original + eps
+            plus = float(loss())
+            parameter[index] = original - eps
+            minus = float(loss())
+            parameter[index] = original
+            gradient[index] = (plus - minus) / (2 * eps)
+    return gradient
+
+
+def _check(loss, *parameters):
+    loss()
+    g.get().backward()
+    for parameter in parameters:
+        np.testing.assert_allclose(
+            parameter.gradient,
+            _numerical_gradient(loss, parameter),
+            rtol=1e-5,
+            atol=1e-7,
+        )
+
+
+def test_parameter_reused_by_many_operations(random):
+    X = random.standard_normal((5, 3))
+    W = g.Parameter(random.standard_normal(3))
+    _check(lambda: g.mean(g.add(g.dot(X, W), g.multiply(g.dot(X, W), 3))), W)
+
+
+def test_node_with_fan_out(random):
+    X = random.standard_normal((5, 3))
+    W = g.Parameter(random.standard_normal(3))
+
+    def loss():
+        hidden = g.tanh(g.dot(X, W))
+        return g.mean(g.add(g.square(hidden), g.multiply(hidden, hidden)))
+
+    _check(loss, W)
+
+
+def test_operators_are_recorded(random):
+    X = random.standard_normal((6, 3))
+    y = random.standard_normal(6)
+    W = g.Parameter(random.standard_normal(3))
+    b = g.Parameter(np.zeros(1))
+    _check(lambda: ((X @ W * 2 + b - y) ** 2).mean() + np.exp(W / 4).sum(), W, b)
+
+
+def test_deep_chain_does_not_recurse(random):
+    W = g.Parameter(random.standard_normal(2))
+    output = W
+    for _ in range(5000):
+        output = g.add(output, 0.0)
+    g.mean(output)
+    g.get().backward()
+    np.testing.assert_allclose(W.gradient, [0.5, 0.5])
+
+
+def test_checkpoint_gives_identical_gradients(random):
+    X = random.standard_normal((4, 3))
+    W = g.Parameter(random.standard_normal((3, 3)))
+
+    def gradient(checkpointed):
+        hidden = X
+        for _ in range(3):
+            if checkpointed:
+                with g.checkpoint():
+                    hidden = np.tanh(hidden @ W)
+            else:
+                hidden = np.tanh(hidden @ W)
+        g.mean(hidden)
+        g.get().backward()
+        result = W.gradient.copy()
+        W.zero_gradient()
+        return result
+
+    np.testing.assert_allclose(gradient(True), gradient(False))
+
+
+def test_backward_seeds_only_loss(random):
+    X = random.standard_normal((5, 3))
+    y = random.standard_normal(5)
+    W = g.Parameter(random.standard_normal(3))
+
+    def loss():
+        return g.mean(g.squared_error(g.dot(X, W), y))
+
+    loss()
+    g.get().backward()
+    expected = W.gradient.copy()
+    W.zero_gradient()
+
+    stray = W - 1  # noqa: F841 kept alive until backward
+    loss()
+    with pytest.warns(RuntimeWarning, match="do not contribute"):
+        g.get().backward()
+    np.testing.assert_allclose(W.gradient, expected)
+
+
+def test_unrecorded_ufuncs_return_plain_arrays():
+    W = g.Parameter(np.array([1.0, -2.0, 3.0]))
+    assert type(W > 0) is np.ndarray
+    assert type(np.sign(W)) is np.ndarray
+    assert type(W[:2] * 2) is np.ndarray
+    assert type(sparse.eye(3, format="csr") @ W) is np.ndarray
+    with g.no_grad():
+        assert type(W * 2) is np.ndarray
+        assert type(np.maximum(W, 0)) is np.ndarray
+
+
+@pytest.mark.parametrize(
+    "function",
+    [
+        lambda h: np.maximum(h, 0),
+        abs,
+        lambda h: np.power(h, 3),
+        lambda h: np.clip(h, -1, 1),
+        lambda h: np.cumsum(h),
+        lambda h: h.max(),
+    ],
+)
+def test_unsupported_ufunc_on_recorded_array_raises(random, function):
+    W = g.Parameter(random.standard_normal(3))
+    with pytest.raises(TypeError, match="no graph operation"):
+        function(random.standard_normal((4, 3)) @ W)
+
+
+def test_numpy_dot_is_recorded(random):
+    X = random.standard_normal((4, 3))
+    W = g.Parameter(random.standard_normal(3))
+    _check(lambda: g.mean(np.dot(X, W)), W)
+
+
+def test_methods_of_derived_arrays_are_not_recorded():
+    W = g.Parameter(np.arange(6.0).reshape(2, 3))
+    assert W[0].mean() == 1
+    assert W.T.sum() == 15
+    np.testing.assert_array_equal(np.mean(W[:, 0]), 1.5)
+    assert not g.get().operations
+
+
+@pytest.mark.parametrize(
+    "derive", [lambda h: h[:, 0], lambda h: h.reshape(-1), lambda h: h.T]
+)
+def test_views_of_recorded_arrays_are_rejected(random, derive):
+    W = g.Parameter(random.standard_normal((3, 1)))
+    hidden = random.standard_normal((4, 3)) @ W
+    with pytest.raises(ValueError, match="derived from Parameter"):
+        g.mean(derive(hidden))
+
+
+def test_backward_requires_scalar_loss(random):
+    X = random.standard_normal((4, 3))
+    W = g.Parameter(random.standard_normal(3))
+    X @ W
+    with pytest.raises(ValueError, match="scalar"):
+        g.get().backward()
+    g.get().backward(np.ones(4))
+    np.testing.assert_allclose(W.gradient, X.sum(axis=0))
+
+
+def test_unregistered_view_is_rejected():
+    W = g.Parameter(np.ones((2, 3)))
+    with pytest.raises(ValueError):
+        g.sum(g.dot(np.ones((4, 3)), W.T))
+
+
+def test_no_grad_records_nothing():
+    W = g.Parameter(np.ones(3))
+    with g.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("error")
+        g.mean(g.add(W, 1))
+    assert not g.get().operations
+
+
+def test_output_kept_across_backward_is_rejected(random):
+    X = random.standard_normal((4, 3))
+    W = g.Parameter(random.standard_normal(3))
+    V = g.Parameter(np.ones(()))
+    hidden = X @ W
+    g.mean(hidden)
+    g.get().backward()
+
+    doubled = V * 2
+    with pytest.raises(ValueError, match="already backpropagated"):
+        g.add(doubled, hidden)
+    # Without recorded inputs it is a constant
+    assert type(hidden * 2) is np.ndarray
+
+
+def test_output_of_other_graph_is_rejected(random):
+    W = g.Parameter(random.standard_normal(3))
+    hidden = random.standard_normal((4, 3)) @ W
+    with g.scope():
+        V = g.Parameter(np.ones(3))
+        with pytest.raises(ValueError, match="another graph"):
+            g.add(V, hidden)
+
+
+def test_tape_does_not_grow_without_backward(random):
+    X = random.standard_normal((100, 3))
+    W = g.Parameter(random.standard_normal(3))
+    b = g.Parameter(np.zeros(1))
+    for _ in range(100):
+        X @ W + b
+    # Only the last operation (it could still be the loss) and it's inputs
+    assert len(g.get().operations) == 2
+
+    kept = X @ W + b
+    for _ in range(10):
+        X @ W + b
+    assert len(g.get().operations) == 4
+    del kept
+    assert len(g.get().operations) == 2
+
+
+def test_collected_outputs_consumed_by_loss_are_kept(random):
+    X = random.standard_normal((5, 3))
+    W = g.Parameter(random.standard_normal(3))
+    _check(lambda: g.mean(g.tanh(X @ W) * 3), W)
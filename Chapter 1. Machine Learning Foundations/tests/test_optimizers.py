@@ -0,0 +1,127 @@
+import gc
+import pickle
+
+import numpy as np
+import pytest
+
+from aicore.ml import graph as g
+from aicore.ml.graph import models, optimizers
+
+
+def _sgd(lr):
+    def step(parameter, gradient, state):
+        return parameter - lr * gradient
+
+    return step
+
+
+def _momentum(lr, momentum, nesterov):
+    def step(parameter, gradient, state):
+        velocity = momentum * state.get("velocity", 0) + gradient
+        state["velocity"] = velocity
+        if nesterov:
+            return parameter - lr * (gradient + momentum * velocity)
+        return parameter - lr * velocity
+
+    return step
+
+
+def _rmsprop(lr, rho, eps):
+    def step(parameter, gradient, state):
+        average = rho * state.get("average", 0) + (1 - rho) * gradient ** 2
+        state["average"] = average
+        return parameter - lr * gradient / (np.sqrt(average) + eps)
+
+    return step
+
+
+def _adam(lr, beta1, beta2, eps, decay=0.0):
+    def step(parameter, gradient, state):
+        parameter = parameter * (1 - lr * decay)
+        t = state["t"] = state.get("t", 0) + 1
+        m = state["m"] = beta1 * state.get("m", 0) + (1 - beta1) * gradient
+        v = state["v"] = beta2 * state.get("v", 0) + (1 - beta2) * gradient ** 2
+        m_hat, v_hat = m / (1 - beta1 ** t), v / (1 - beta2 ** t)
+        return parameter - lr * m_hat / (np.sqrt(v_hat) + eps)
+
+    return step
+
+
+REFERENCES = {
+    "sgd": (optimizers.SGD(0.1), _sgd(0.1)),
+    "momentum": (optimizers.Momentum(0.1, 0.9), _momentum(0.1, 0.9, False)),
+    "nesterov": (
+        optimizers.Momentum(0.1, 0.9, nesterov=True),
+        _momentum(0.1, 0.9, True),
+    ),
+    "rmsprop": (optimizers.RMSProp(0.1, 0.9, 1e-8), _rmsprop(0.1, 0.9, 1e-8)),
+    "adam": (optimizers.Adam(0.1, 0.9, 0.999, 1e-8), _adam(0.1, 0.9, 0.999, 1e-8)),
+    "adamw": (
+        optimizers.AdamW(0.1, 0.9, 0.999, 1e-8, decay=0.1),
+        _adam(0.1, 0.9, 0.999, 1e-8, decay=0.1),
+    ),
+}
+
+
+@pytest.mark.parametrize("name", sorted(REFERENCES))
+def test_optimizer_matches_reference(random, name):
+    optimizer, reference = REFERENCES[name]
+    parameter = g.Parameter(random.standard_normal((3, 2)))
+    expected, state = np.array(parameter), {}
+    for _ in range(5):
+        gradient = random.standard_normal((3, 2))
+        parameter.gradient = gradient.copy()
+        optimizer([parameter])
+        expected = reference(expected, gradient, state)
+        np.testing.assert_allclose(parameter, expected)
+        np.testing.assert_array_equal(parameter.gradient, 0)
+
+
+def test_optimizer_step_is_not_recorded(random):
+    parameter = g.Parameter(random.standard_normal(3))
+    parameter.gradient = np.ones(3)
+    optimizers.Adam(0.1)([parameter])
+    assert not g.get().operations
+
+
+def test_state_of_collected_parameter_is_evicted(random):
+    optimizer = optimizers.Adam(0.1)
+    parameter = g.Parameter(random.standard_normal(3))
+    parameter.gradient = np.ones(3)
+    optimizer([parameter])
+    assert len(optimizer.state) == 1
+    g.get().clear()
+    del parameter
+    gc.collect()
+    assert optimizer.state == {}
+
+
+def test_optimizer_reused_across_models(random):
+    optimizer = optimizers.Adam(0.1)
+    for n_features in (3, 5, 2):
+        X = random.standard_normal((20, n_features))
+        y = random.integers(4, size=20)
+        model = models.MulticlassLogisticRegression(4, n_features, optimizer)
+        model.fit(X, y, epochs=2)
+        g.get().clear()
+
+
+def test_state_is_rebuilt_for_new_shape(random):
+    optimizer = optimizers.Momentum(0.1)
+    parameter = g.Parameter(np.zeros(3))
+    parameter.gradient = np.ones(3)
+    optimizer([parameter])
+    reshaped = parameter.reshape(3, 1)
+    reshaped.gradient = np.ones((3, 1))
+    optimizer([reshaped])
+    assert optimizer.state[id(reshaped)]["velocity"].shape == (3, 1)
+
+
+def test_pickled_optimizer_drops_state(random):
+    optimizer = optimizers.Adam(0.1)
+    parameter = g.Parameter(random.standard_normal(3))
+    parameter.gradient = np.ones(3)
+    optimizer([parameter])
+    restored = pickle.loads(pickle.dumps(optimizer))
+    assert restored.state == {}
+    assert restored.lr == optimizer.lr
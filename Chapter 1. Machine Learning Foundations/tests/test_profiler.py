@@ -0,0 +1,79 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from aicore.ml import graph as g
+from aicore.ml.graph import models, optimizers
+
+
+def test_inputs_are_not_counted_as_cached(random):
+    X = random.standard_normal((1000, 5))
+    W = g.Parameter(random.standard_normal(5))
+    with g.profile() as profiler:
+        g.mean(g.tanh(X @ W))
+        g.get().backward()
+    assert profiler.stats["_Dot"]["cached_bytes"] == 0
+    # Output of tanh is kept for backward
+    assert profiler.stats["_Tanh"]["cached_bytes"] == 1000 * X.itemsize
+
+
+def test_cast_copies_are_counted_as_cached(random):
+    X = random.standard_normal((1000, 5))
+    W = g.Parameter(random.standard_normal(5))
+    g.set_default_dtype(compute_dtype=np.float32)
+    try:
+        with g.profile() as profiler:
+            g.mean(X @ W)
+            g.get().backward()
+    finally:
+        g.set_default_dtype()
+    assert profiler.stats["_Dot"]["cached_bytes"] >= X.size * 4
+
+
+def _train(random):
+    X = random.standard_normal((64, 4))
+    model = models.BinaryLogisticRegression(4, optimizers.SGD(0.1))
+    model.fit(X, random.integers(2, size=64).astype(float), epochs=3, batch_size=32)
+
+
+def test_stats_of_training(random):
+    with g.profile() as profiler:
+        _train(random)
+    # 3 epochs of 2 batches
+    assert profiler.stats["_Dot"]["calls"] == 6
+    for name in ("_Dot", "_Add", "_BCEWithLogits", "_Mean"):
+        assert profiler.stats[name]["forward"] > 0
+        assert profiler.stats[name]["backward"] > 0
+    table = profiler.table().splitlines()
+    assert table[0].split()[0] == "Operation"
+    assert len(table) == 2 + len(profiler.stats)
+
+
+def test_profiling_is_scoped(random):
+    with g.profile() as profiler:
+        pass
+    _train(random)
+    assert not profiler.stats
+    with pytest.raises(ValueError):
+        profiler.chrome_trace("unused.json")
+
+
+def test_profiling_is_thread_local(random):
+    with g.profile() as profiler:
+        thread = threading.Thread(target=_train, args=(random,))
+        thread.start()
+        thread.join()
+    assert not profiler.stats
+
+
+def test_chrome_trace(random, tmp_path):
+    with g.profile(trace=True) as profiler:
+        _train(random)
+    path = tmp_path / "trace.json"
+    profiler.chrome_trace(path)
+    events = json.loads(path.read_text())["traceEvents"]
+    assert len(events) == sum(stats["calls"] for stats in profiler.stats.values()) * 2
+    assert {event["cat"] for event in events} == {"forward", "backward"}
+    assert all(event["dur"] >= 0 for event in events)